@@ -0,0 +1,57 @@
+import threading
+import time
+
+from cachetools import TTLCache
+from sqlalchemy import event
+
+import models
+import schemas
+from config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+# cachetools caches are not thread-safe and sync dependencies run in the
+# thread pool, so every access goes through the lock
+_lock = threading.Lock()
+_users: TTLCache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_tokens: TTLCache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def get_user(user_id: int) -> schemas.Principal | None:
+    with _lock:
+        return _users.get(user_id)
+
+
+def cache_user(principal: schemas.Principal):
+    with _lock:
+        _users[principal.id] = principal
+
+
+def invalidate_user(user_id: int):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def get_token(token: str) -> dict | None:
+    with _lock:
+        payload = _tokens.get(token)
+    if payload is not None and payload.get("exp", 0) <= time.time():
+        return None
+    return payload
+
+
+def cache_token(token: str, payload: dict):
+    with _lock:
+        _tokens[token] = payload
+
+
+def clear():
+    with _lock:
+        _users.clear()
+        _tokens.clear()
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    # catches deactivation or any other change made through the ORM in this
+    # process; other workers pick it up when AUTH_CACHE_TTL expires
+    invalidate_user(target.id)
@@ -0,0 +1,160 @@
+import argparse
+
+import numpy as np
+
+from config import INFERENCE_BACKEND, INFERENCE_INTER_OP_THREADS, INFERENCE_THREADS, MODEL_PATH
+from labels import NUM_CLASSES
+
+
+class InferenceBackend:
+    # runs MobileNetV2 on a float32 batch of shape (n, 224, 224, 3) and returns
+    # (class probabilities, penultimate-layer embeddings)
+    name = ""
+    default_path: str | None = None
+
+    def __init__(self, path: str | None = None, threads: int = INFERENCE_THREADS,
+                 inter_op_threads: int = INFERENCE_INTER_OP_THREADS):
+        self.path = path or self.default_path
+        self.threads = threads
+        self.inter_op_threads = inter_op_threads
+
+    def load(self):
+        raise NotImplementedError
+
+    def predict(self, batch: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+def build_keras_model(weights: str | None = None):
+    import tensorflow as tf
+
+    # local weights file for offline deployments, otherwise the keras download
+    model = tf.keras.applications.MobileNetV2(weights=weights or "imagenet")
+    # penultimate layer (global average pooling) output is used as the image embedding
+    return tf.keras.Model(model.inputs, [model.output, model.layers[-2].output])
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def load(self):
+        import tensorflow as tf
+
+        # only takes effect before the first op creates the runtime, which
+        # is why every process loads its own model instead of forking one
+        if self.threads:
+            tf.config.threading.set_intra_op_parallelism_threads(self.threads)
+        if self.inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        self.model = build_keras_model(self.path)
+
+    def predict(self, batch):
+        # direct model call skips the per-call overhead of model.predict
+        predictions, embeddings = self.model(batch, training=False)
+        return predictions.numpy(), embeddings.numpy()
+
+
+def split_outputs(outputs: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    # converted models do not keep output order, tell them apart by width
+    if outputs[0].shape[-1] == NUM_CLASSES:
+        return outputs[0], outputs[1]
+    return outputs[1], outputs[0]
+
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+    default_path = "mobilenet_v2.tflite"
+
+    def load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        # the model file is memory-mapped read-only, so the workers on a node
+        # share one copy of it through the page cache (the XNNPACK delegate
+        # still packs its own copy of the float weights per process)
+        self.interpreter = Interpreter(
+            model_path=self.path, num_threads=self.threads or None)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_indices = [
+            output["index"] for output in self.interpreter.get_output_details()]
+        self.batch_size = None
+
+    def predict(self, batch):
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(batch)
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return split_outputs([self.interpreter.get_tensor(index) for index in self.output_indices])
+
+
+class OnnxBackend(InferenceBackend):
+    name = "onnx"
+    default_path = "mobilenet_v2.onnx"
+
+    def load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+        self.session = ort.InferenceSession(
+            self.path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return split_outputs(self.session.run(None, {self.input_name: batch}))
+
+
+BACKENDS = {backend.name: backend for backend in (
+    KerasBackend, TFLiteBackend, OnnxBackend)}
+
+
+def create_backend(name: str = INFERENCE_BACKEND, path: str | None = MODEL_PATH) -> InferenceBackend:
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](path)
+
+
+def convert_tflite(output: str, weights: str | None = None, quantize: bool = False):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(
+        build_keras_model(weights))
+    if quantize:
+        # dynamic range quantization: int8 weights, float activations
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(output: str, weights: str | None = None, quantize: bool = False):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = build_keras_model(weights)
+    signature = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=signature, output_path=output)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(output, output, weight_type=QuantType.QInt8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert MobileNetV2 for the tflite and onnx backends")
+    parser.add_argument("format", choices=["tflite", "onnx"])
+    parser.add_argument("--output")
+    parser.add_argument("--weights", help="local keras weights file")
+    parser.add_argument("--int8", action="store_true",
+                        help="quantize weights to int8")
+    args = parser.parse_args()
+    convert = convert_tflite if args.format == "tflite" else convert_onnx
+    convert(args.output or BACKENDS[args.format].default_path,
+            weights=args.weights, quantize=args.int8)
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+# reproducible load test of the app in-process: a synthetic corpus in a fresh
+# SQLite database, synthetic JPEG uploads and a deterministic stand-in for
+# the model, so results only change when the code does
+
+VOCABULARY_SIZE = 1000
+EMBEDDING_SIZE = 1280
+PASSWORD = "benchmark"
+
+
+def configure_environment(workdir: str):
+    # must run before the app modules are imported, they read config at
+    # import; the workdir is wiped since stored files from a previous run
+    # would turn uploads into no-ops
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    database = os.path.join(workdir, "benchmark.db")
+    labels_path = os.path.join(workdir, "labels.txt")
+    with open(labels_path, "w") as f:
+        f.writelines(f"{i} label{i}\n" for i in range(VOCABULARY_SIZE))
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{database}",
+        "LABELS_PATH": labels_path,
+        "IMAGE_STORE_DIR": os.path.join(workdir, "images"),
+        "UPLOAD_SPOOL_DIR": os.path.join(workdir, "spool"),
+        "MODEL_PRELOAD": "0",
+    })
+
+
+def create_fake_backend():
+    from backends import InferenceBackend
+
+    class FakeBackend(InferenceBackend):
+        # class scores and embeddings derived from a checksum of the input,
+        # so the same image always gets the same tags
+        name = "fake"
+
+        def load(self):
+            pass
+
+        def predict(self, batch):
+            predictions = np.empty((len(batch), VOCABULARY_SIZE), dtype=np.float32)
+            embeddings = np.empty((len(batch), EMBEDDING_SIZE), dtype=np.float32)
+            for i, image in enumerate(batch):
+                rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(image).tobytes()))
+                logits = rng.standard_normal(VOCABULARY_SIZE) * 4
+                scores = np.exp(logits - logits.max())
+                predictions[i] = scores / scores.sum()
+                embeddings[i] = rng.standard_normal(EMBEDDING_SIZE)
+            return predictions, embeddings
+
+    return FakeBackend()
+
+
+def tag_weights() -> np.ndarray:
+    # tag popularity is heavily skewed, like in real libraries
+    weights = 1 / np.arange(1, VOCABULARY_SIZE + 1) ** 1.1
+    return weights / weights.sum()
+
+
+def synthetic_jpeg(rng: np.random.Generator, size: tuple[int, int], quality: int = 85) -> bytes:
+    # smooth gradients plus noise compress like photos rather than like flat fills
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    colors = rng.uniform(0, 255, (3, 3)).astype(np.float32)
+    channels = [c[0] * x + c[1] * y + c[2] * x * y for c in colors]
+    pixels = np.stack(channels, axis=-1) / 2 + rng.normal(0, 12, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def seed(args, rng: np.random.Generator) -> list[str]:
+    from sqlalchemy import insert
+
+    import crud
+    import models
+    from database import SessionLocal
+    from utils import get_password_hash
+
+    weights = tag_weights()
+    db = SessionLocal()
+    try:
+        # every user shares one hash, hashing is benchmarked through /token
+        hashed_password = get_password_hash(PASSWORD)
+        usernames = [f"user{i}" for i in range(args.users)]
+        db.execute(insert(models.User), [
+            {"username": username, "email": f"{username}@example.com", "hashed_password": hashed_password, "is_active": True}
+            for username in usernames])
+        user_ids = [user_id for user_id, in db.query(models.User.id).order_by(models.User.id)]
+
+        image_rows = [
+            {"path": f"IMG_{owner_id}_{i}.jpg", "sha256": rng.bytes(32).hex(), "phash": rng.bytes(8).hex(), "owner_id": owner_id}
+            for owner_id in user_ids for i in range(args.images)]
+        db.execute(insert(models.Image), image_rows)
+        images = db.query(models.Image.id, models.Image.owner_id).order_by(models.Image.id).all()
+
+        object_rows = []
+        for image_id, _ in images:
+            count = rng.integers(1, args.tags + 1)
+            class_ids = rng.choice(VOCABULARY_SIZE, size=count, replace=False, p=weights)
+            scores = np.sort(rng.uniform(0.1, 1.0, count))[::-1]
+            object_rows.extend({"object": f"label{class_id}", "score": float(score), "image_id": image_id}
+                               for class_id, score in zip(class_ids, scores))
+        db.execute(insert(models.ImageObject), object_rows)
+
+        images_by_owner: dict[int, list[int]] = {}
+        for image_id, owner_id in images:
+            images_by_owner.setdefault(owner_id, []).append(image_id)
+        album_rows, album_image_rows, favorite_rows = [], [], []
+        for owner_id, owner_images in images_by_owner.items():
+            for i in range(args.albums):
+                album_rows.append({"name": f"album {owner_id}-{i}", "owner_id": owner_id})
+            size = min(args.favorites, len(owner_images))
+            favorite_rows.extend({"owner_id": owner_id, "image_id": int(image_id)}
+                                 for image_id in rng.choice(owner_images, size=size, replace=False))
+        db.execute(insert(models.Album), album_rows)
+        for album_id, owner_id in db.query(models.Album.id, models.Album.owner_id):
+            owner_images = images_by_owner[owner_id]
+            size = min(args.album_size, len(owner_images))
+            album_image_rows.extend({"album_id": album_id, "image_id": int(image_id)}
+                                    for image_id in rng.choice(owner_images, size=size, replace=False))
+        if album_image_rows:
+            db.execute(insert(models.album_image_association_table), album_image_rows)
+        if favorite_rows:
+            db.execute(insert(models.Favorite), favorite_rows)
+        db.commit()
+
+        crud.rebuild_tag_index(db)
+        crud.rebuild_tag_counts(db)
+    finally:
+        db.close()
+    return usernames
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    result = {"requests": len(latencies), "errors": errors,
+              "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result.update({"mean_ms": round(float(np.mean(latencies)) * 1000, 2),
+                       "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)})
+    return result
+
+
+async def measure(send, requests: int, concurrency: int, warmup: int) -> dict:
+    # send(i) performs the i-th request and returns the response
+    for i in range(warmup):
+        await send(i)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def timed(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await send(warmup + i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(args) -> dict:
+    import httpx
+
+    import classifier
+    import main
+
+    rng = np.random.default_rng(args.seed)
+    usernames = seed(args, rng)
+    classifier._backend = create_fake_backend()
+    weights = tag_weights()
+    queries = [f"label{class_id}" for class_id in rng.choice(VOCABULARY_SIZE, size=args.requests + args.warmup, p=weights)]
+    uploads = [synthetic_jpeg(rng, (args.image_width, args.image_height))
+               for _ in range(args.requests + args.warmup)]
+    random.seed(args.seed)
+    upload_users = [random.randint(1, args.users) for _ in uploads]
+
+    results = {}
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            scenarios = {
+                "create_image_for_user": (lambda i: client.post(
+                    f"/users/{upload_users[i]}/images/", files={"file": (f"upload{i}.jpg", uploads[i], "image/jpeg")}), args.requests),
+                "read_images_by_object": (lambda i: client.get(
+                    f"/images/{queries[i]}", params={"limit": args.page_size}), args.requests),
+                "read_albums": (lambda i: client.get(
+                    "/images/albums/", params={"limit": args.page_size, "expand": "images"}), args.requests),
+                "token": (lambda i: client.post(
+                    "/token", data={"username": usernames[i % len(usernames)], "password": PASSWORD}), args.login_requests),
+            }
+            for name, (send, requests) in scenarios.items():
+                if args.only and name not in args.only:
+                    continue
+                results[name] = await measure(send, requests, args.concurrency, args.warmup)
+                print(f"{name}: {json.dumps(results[name])}")
+    finally:
+        await main.app.router.shutdown()
+    return results
+
+
+def git_revision() -> str | None:
+    def git(*command):
+        return subprocess.run(["git", *command], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+
+    try:
+        revision = git("rev-parse", "HEAD")
+        dirty = git("status", "--porcelain", "--untracked-files=no")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark upload, search, album listing and login")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--images", type=int, default=200, help="images per user")
+    parser.add_argument("--tags", type=int, default=5, help="max tags per image")
+    parser.add_argument("--albums", type=int, default=5, help="albums per user")
+    parser.add_argument("--album-size", type=int, default=20, help="images per album")
+    parser.add_argument("--favorites", type=int, default=20, help="favorites per user")
+    parser.add_argument("--image-width", type=int, default=1024)
+    parser.add_argument("--image-height", type=int, default=768)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="measured requests for /token")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "searching-images-benchmark"))
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    configure_environment(args.workdir)
+    results = asyncio.run(run(args))
+    report = {
+        "revision": git_revision(),
+        "date": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("workdir", "output")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
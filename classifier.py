@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+
+import labels
+from backends import InferenceBackend, create_backend
+from hashing import perceptual_hash
+from metrics import Gauge, stage_seconds, timer
+from config import TAGGING_MIN_SCORE, TAGGING_TOP_K, THUMBNAIL_SIZES
+from preprocessing import IMAGE_SIZE, InvalidImageError, decode_image, encode_thumbnail, read_imagefile, resize, to_tensor
+from storage import get_store
+
+_backend: InferenceBackend | None = None
+_backend_lock = threading.Lock()
+# not_loaded, loading, warming_up, ready or failed; reported by /ready
+model_state = "not_loaded"
+model_ready = Gauge("model_ready", "1 once the model is loaded and warmed up")
+
+
+def set_model_state(state: str):
+    global model_state
+    model_state = state
+    model_ready.set(1 if state == "ready" else 0)
+
+
+def get_backend(warmup_batch_sizes: list[int] | None = None) -> InferenceBackend:
+    # the model is loaded on first use (or by the startup warm-up), so
+    # importing this module does not pull in the inference runtime
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                try:
+                    set_model_state("loading")
+                    backend = create_backend()
+                    backend.load()
+                    set_model_state("warming_up")
+                    # the first call with each batch size allocates buffers and
+                    # picks kernels, keep that out of the first requests
+                    for size in warmup_batch_sizes or []:
+                        backend.predict(np.zeros((size, *IMAGE_SIZE, 3), dtype=np.float32))
+                except Exception:
+                    set_model_state("failed")
+                    raise
+                _backend = backend
+                set_model_state("ready")
+    return _backend
+
+
+def decode_upload(file, sha256: str | None = None) -> tuple[np.ndarray, str]:
+    # one decode feeds both the model input and, when the content hash is
+    # given, the stored thumbnails
+    sizes = THUMBNAIL_SIZES if sha256 else []
+    min_size = max(IMAGE_SIZE[0] * 2, *sizes)
+    with timer(stage_seconds, stage="decode"):
+        decoded = decode_image(file, (min_size, min_size))
+        image = to_tensor(resize(decoded))
+    if sha256:
+        store = get_store()
+        with timer(stage_seconds, stage="thumbnails"):
+            for size in sizes:
+                store.save_thumbnail(sha256, size, encode_thumbnail(decoded, size))
+    return image, perceptual_hash(image)
+
+
+def predict_batch(batch: np.ndarray) -> list[tuple[np.ndarray, np.ndarray]]:
+    predictions, embeddings = get_backend().predict(batch)
+    return list(zip(predictions, embeddings))
+
+
+def decode_prediction(output: tuple[np.ndarray, np.ndarray]) -> tuple[list[tuple[str, float]], np.ndarray]:
+    prediction, embedding = output
+    return labels.top_k(prediction, TAGGING_TOP_K, TAGGING_MIN_SCORE), embedding
+
+
+def classify_files(paths: list[str]) -> list[tuple[list[tuple[str, float]], np.ndarray] | None]:
+    # decodes a chunk of stored files and runs them through the model in one
+    # batch; unreadable files give None
+    images = []
+    for path in paths:
+        try:
+            images.append(read_imagefile(path))
+        except (InvalidImageError, OSError):
+            images.append(None)
+    decoded = [image for image in images if image is not None]
+    outputs = iter(predict_batch(np.stack(decoded)) if decoded else [])
+    return [decode_prediction(next(outputs)) if image is not None else None for image in images]
+
+
+def classify_file(path: str, sha256: str | None = None) -> tuple[list[tuple[str, float]], np.ndarray, str]:
+    # used by the background workers, which run outside the API process
+    with open(path, 'rb') as f:
+        image, phash = decode_upload(f, sha256)
+    objects, embedding = decode_prediction(predict_batch(np.array([image]))[0])
+    return objects, embedding, phash
@@ -0,0 +1,108 @@
+import os
+
+# max number of images passed to the model in one call
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "32"))
+# how long (ms) to wait for more requests before running a partial batch
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+# "<class_id> <label>" per line; the Keras ImageNet mapping is used when missing
+LABELS_PATH = os.getenv("LABELS_PATH", "imagenet_classes.txt")
+
+# an upload is tagged with up to TAGGING_TOP_K classes scoring at least
+# TAGGING_MIN_SCORE; the best class is always kept
+TAGGING_TOP_K = int(os.getenv("TAGGING_TOP_K", "5"))
+TAGGING_MIN_SCORE = float(os.getenv("TAGGING_MIN_SCORE", "0.1"))
+
+# background classification (opt-in with ?background=true on upload)
+CLASSIFICATION_WORKERS = int(os.getenv("CLASSIFICATION_WORKERS", "2"))
+# uploads beyond this many unfinished jobs are rejected with 503
+CLASSIFICATION_QUEUE_SIZE = int(os.getenv("CLASSIFICATION_QUEUE_SIZE", "100"))
+# uploaded files wait here until their classification job finishes
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "./spool")
+
+# uploads with more pixels are rejected before decoding (decompression bombs)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "64000000"))
+
+# keras, tflite or onnx (see backends.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+# keras weights file or converted tflite/onnx model; empty for the defaults
+MODEL_PATH = os.getenv("MODEL_PATH") or None
+# stored with every classification result; change it together with the model
+# or the tagging thresholds and run `python jobs.py reclassify`
+MODEL_VERSION = os.getenv("MODEL_VERSION", "mobilenet_v2")
+# restricts tag search to one model version (plus manual tags) while a
+# reclassification is in progress; empty searches every version
+SEARCH_MODEL_VERSION = os.getenv("SEARCH_MODEL_VERSION") or None
+# API worker processes per node (read by uvicorn and gunicorn as well)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# threads per model call (intra-op), 0 keeps the runtime default of one per
+# core; with several workers the cores are split between them by default so
+# the workers do not oversubscribe the node
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS") or (
+    max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY) if WEB_CONCURRENCY > 1 else 0))
+# threads running independent ops of one call in parallel (keras and onnx)
+INFERENCE_INTER_OP_THREADS = int(os.getenv("INFERENCE_INTER_OP_THREADS") or (
+    1 if WEB_CONCURRENCY > 1 else 0))
+# width of the image embeddings (MobileNetV2 penultimate layer)
+EMBEDDING_SIZE = int(os.getenv("EMBEDDING_SIZE", "1280"))
+# load the model during startup instead of on the first classification
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "1") == "1"
+# batch sizes run through the preloaded model before the worker reports ready
+MODEL_WARMUP_BATCH_SIZES = [int(size) for size in os.getenv("MODEL_WARMUP_BATCH_SIZES", "1").split(",") if size]
+
+# upper bound for ?limit= on list and search endpoints
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+# change log entries returned per /users/me/changes call
+MAX_CHANGES_PAGE_SIZE = int(os.getenv("MAX_CHANGES_PAGE_SIZE", "1000"))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+# derived from DATABASE_URL (aiosqlite / asyncpg) unless set explicitly
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or None
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# SQLite connection tuning, applied to every new connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# authenticated users and decoded tokens are cached in-process for this long
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+# bcrypt cost factor; hashes with another cost are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# processes that hash and verify passwords, off the API worker's threads
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+
+# originals and thumbnails are stored by content hash under IMAGE_STORE_DIR
+IMAGE_STORE = os.getenv("IMAGE_STORE", "local")
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "./images")
+# longest side in pixels of each generated thumbnail; the first is the default
+THUMBNAIL_SIZES = [int(size) for size in os.getenv("THUMBNAIL_SIZES", "256,1024").split(",")]
+# WEBP or JPEG
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+# uploads are hashed and decoded straight from starlette's spooled temp file;
+# larger files are rejected with 413
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+# requests with a larger Content-Length are rejected before the body is parsed
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", str(200 * 1024 * 1024)))
+# POST /users/me/import is streamed and has its own limit
+MAX_IMPORT_SIZE = int(os.getenv("MAX_IMPORT_SIZE", str(4 * 1024 * 1024 * 1024)))
+# longest accepted import line; an image with its embedding is about 4KB
+# and albums are exported in records of at most EXPORT_CHUNK_SIZE images
+MAX_IMPORT_RECORD_SIZE = int(os.getenv("MAX_IMPORT_RECORD_SIZE", str(64 * 1024)))
+# rows per query of an export and records per transaction of an import
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+# sample the stacks of all threads every PROFILER_INTERVAL_MS and serve them
+# at /debug/profile in collapsed (flamegraph) format
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+
+# pre-serialized responses of the public listing and search endpoints;
+# a TTL of 0 disables the cache
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
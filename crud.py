@@ -1,7 +1,189 @@
-from sqlalchemy.orm import Session
+from collections import Counter
+from typing import Iterable, Sequence
+
+from sqlalchemy import func, insert, literal, or_, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
 import models
 import schemas
-from utils import get_password_hash
+import response_cache
+from config import MODEL_VERSION, SEARCH_MODEL_VERSION
+from pagination import Page, paginate
+from search import prefix_upper_bound, tokenize
+
+# model_version of objects added through the API, kept across reclassifications
+MANUAL_VERSION = "manual"
+
+# entities and actions recorded in the change log
+IMAGE, ALBUM, FAVORITE = "image", "album", "favorite"
+INSERT, UPDATE, DELETE = "insert", "update", "delete"
+
+
+def change_rows(owner_id: int, entity: str, entity_ids: Iterable[int], action: str) -> list[dict]:
+    return [{"owner_id": owner_id, "entity": entity, "entity_id": entity_id, "action": action}
+            for entity_id in entity_ids]
+
+
+def log_change(db: Session, owner_id: int, entity: str, entity_id: int, action: str):
+    # added to the session, so it commits together with the change itself
+    db.add(models.Change(owner_id=owner_id, entity=entity, entity_id=entity_id, action=action))
+
+
+def get_changes(db: Session, user_id: int, since: int, limit: int) -> tuple[list[models.Change], bool]:
+    changes = db.query(models.Change).filter(models.Change.owner_id == user_id, models.Change.id > since).order_by(
+        models.Change.id).limit(limit + 1).all()
+    return changes[:limit], len(changes) > limit
+
+
+def get_images_for_sync(db: Session, image_ids: list[int]):
+    return db.query(models.Image).options(selectinload(models.Image.objects)).filter(models.Image.id.in_(image_ids)).all()
+
+
+def get_album_image_ids(db: Session, album_ids: list[int]) -> dict[int, list[int]]:
+    image_ids = {album_id: [] for album_id in album_ids}
+    table = models.album_image_association_table
+    for album_id, image_id in db.execute(select(table.c.album_id, table.c.image_id).where(table.c.album_id.in_(album_ids))):
+        image_ids[album_id].append(image_id)
+    return image_ids
+
+
+def get_albums_for_sync(db: Session, album_ids: list[int]):
+    albums = db.query(models.Album).filter(models.Album.id.in_(album_ids)).all()
+    image_ids = get_album_image_ids(db, album_ids)
+    return [(album, image_ids[album.id]) for album in albums]
+
+
+def get_favorites_for_sync(db: Session, favorite_ids: list[int]):
+    return db.query(models.Favorite).filter(models.Favorite.id.in_(favorite_ids)).all()
+
+
+def is_change_log_empty(db: Session):
+    return db.query(models.Change.id).first() is None and db.query(models.Image.id).first() is not None
+
+
+def rebuild_change_log(db: Session):
+    # existing data is logged as inserted, so a first sync with since=0
+    # returns the whole library
+    db.query(models.Change).delete()
+    for entity, model in ((IMAGE, models.Image), (ALBUM, models.Album), (FAVORITE, models.Favorite)):
+        db.execute(insert(models.Change).from_select(
+            ["owner_id", "entity", "entity_id", "action"],
+            select(model.owner_id, literal(entity), model.id, literal(INSERT)).order_by(model.id)))
+    db.commit()
+
+
+def get_export_images(db: Session, user_id: int, after_id: int, limit: int, embeddings: bool = True):
+    # plain rows instead of ORM objects, the export never keeps them around
+    vector = models.ImageEmbedding.vector if embeddings else literal(None)
+    return db.query(models.Image.id, models.Image.path, models.Image.sha256, models.Image.phash, vector).outerjoin(
+        models.ImageEmbedding, models.ImageEmbedding.image_id == models.Image.id).filter(
+        models.Image.owner_id == user_id, models.Image.id > after_id).order_by(models.Image.id).limit(limit).all()
+
+
+def get_export_objects(db: Session, image_ids: list[int]):
+    return db.query(models.ImageObject.image_id, models.ImageObject.object, models.ImageObject.score, models.ImageObject.model_version).filter(
+        models.ImageObject.image_id.in_(image_ids)).order_by(models.ImageObject.image_id, models.ImageObject.id).all()
+
+
+def get_export_albums(db: Session, user_id: int, after_id: int, limit: int):
+    return db.query(models.Album.id, models.Album.name).filter(
+        models.Album.owner_id == user_id, models.Album.id > after_id).order_by(models.Album.id).limit(limit).all()
+
+
+def get_export_favorites(db: Session, user_id: int, after_id: int, limit: int):
+    return db.query(models.Favorite.id, models.Favorite.image_id).filter(
+        models.Favorite.owner_id == user_id, models.Favorite.id > after_id).order_by(models.Favorite.id).limit(limit).all()
+
+
+def import_images(db: Session, user_id: int, images: list[schemas.ExportImage]):
+    # one transaction per chunk; images the user already has (same sha256)
+    # are mapped to the existing row instead of being inserted again.
+    # Returns {exported id: id} and the created (image, embedding) pairs.
+    hashes = [image.sha256 for image in images if image.sha256]
+    existing = {sha256: image_id for image_id, sha256 in db.query(models.Image.id, models.Image.sha256).filter(
+        models.Image.owner_id == user_id, models.Image.sha256.in_(hashes))} if hashes else {}
+    image_ids, created, duplicates, pending = {}, [], [], set()
+    for image in images:
+        if image.sha256 in existing:
+            image_ids[image.id] = existing[image.sha256]
+        elif image.sha256 in pending:
+            duplicates.append(image)
+        else:
+            if image.sha256:
+                pending.add(image.sha256)
+            created.append((image, models.Image(path=image.path, sha256=image.sha256, phash=image.phash, owner_id=user_id, imported=True)))
+    db.add_all([db_image for _, db_image in created])
+    db.flush()
+
+    object_rows, tag_rows, embedding_rows, changes = [], [], [], []
+    for image, db_image in created:
+        image_ids[image.id] = db_image.id
+        changes.extend(change_rows(user_id, IMAGE, [db_image.id], INSERT))
+        # one row per (object, model_version), as the unique index requires
+        objects = {}
+        for image_object in image.objects:
+            key = (image_object.object, image_object.model_version)
+            if key not in objects or (image_object.score or 0) > (objects[key] or 0):
+                objects[key] = image_object.score
+        for (object, model_version), score in objects.items():
+            object_rows.append({"object": object, "score": score,
+                                "image_id": db_image.id, "model_version": model_version})
+            tag_rows.extend(tag_index_rows(object, score, db_image.id, model_version))
+        if image.embedding is not None:
+            embedding_rows.append({"image_id": db_image.id, "vector": image.embedding})
+    for model, rows in ((models.ImageObject, object_rows), (models.ImageTag, tag_rows), (models.ImageEmbedding, embedding_rows), (models.Change, changes)):
+        if rows:
+            db.execute(insert(model), rows)
+    increment_tag_counts(db, user_id, [[image_object.object for image_object in image.objects] for image, _ in created])
+    db.commit()
+    response_cache.bump(response_cache.IMAGES)
+    created_ids = {image.sha256: image_ids[image.id] for image, _ in created}
+    for image in duplicates:
+        image_ids[image.id] = created_ids[image.sha256]
+    return image_ids, [(image_ids[image.id], image.embedding) for image, _ in created]
+
+
+def import_albums(db: Session, user_id: int, albums: list[tuple[str, list[int]]]):
+    # albums are matched by name, images missing from an existing album are added
+    names = [name for name, _ in albums]
+    album_ids = {name: album_id for album_id, name in db.query(models.Album.id, models.Album.name).filter(
+        models.Album.owner_id == user_id, models.Album.name.in_(names))}
+    new_albums = [models.Album(name=name, owner_id=user_id) for name in dict.fromkeys(names) if name not in album_ids]
+    db.add_all(new_albums)
+    db.flush()
+    created = {album.id for album in new_albums}
+    album_ids.update({album.name: album.id for album in new_albums})
+
+    present = {(album_id, image_id) for album_id, image_ids in get_album_image_ids(db, list(album_ids.values())).items()
+               for image_id in image_ids}
+    rows, updated = [], set()
+    for name, image_ids in albums:
+        for image_id in image_ids:
+            if (album_ids[name], image_id) not in present:
+                present.add((album_ids[name], image_id))
+                rows.append({"album_id": album_ids[name], "image_id": image_id})
+                updated.add(album_ids[name])
+    if rows:
+        db.execute(insert(models.album_image_association_table), rows)
+    changes = change_rows(user_id, ALBUM, sorted(created), INSERT) + change_rows(user_id, ALBUM, sorted(updated - created), UPDATE)
+    if changes:
+        db.execute(insert(models.Change), changes)
+    db.commit()
+    response_cache.bump(response_cache.ALBUMS)
+    return len(created)
+
+
+def import_favorites(db: Session, user_id: int, image_ids: list[int]):
+    existing = {image_id for image_id, in db.query(models.Favorite.image_id).filter(
+        models.Favorite.owner_id == user_id, models.Favorite.image_id.in_(image_ids))}
+    favorites = [models.Favorite(owner_id=user_id, image_id=image_id)
+                 for image_id in dict.fromkeys(image_ids) if image_id not in existing]
+    db.add_all(favorites)
+    db.flush()
+    if favorites:
+        db.execute(insert(models.Change), change_rows(user_id, FAVORITE, [favorite.id for favorite in favorites], INSERT))
+    db.commit()
+    return len(favorites)
 
 
 def get_user(db: Session, user_id: int):
@@ -16,75 +198,333 @@ def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, cursor: str | None = None, limit: int = 100, expand: Sequence[str] = (), skip: int = 0) -> Page:
+    query = db.query(models.User)
+    # requested collections are loaded with one extra SELECT each
+    if "images" in expand:
+        query = query.options(selectinload(models.User.images).selectinload(models.Image.objects))
+    if "albums" in expand:
+        query = query.options(selectinload(models.User.albums))
+    if "favorites" in expand:
+        query = query.options(selectinload(models.User.favorites))
+    return paginate(query, [(models.User.id, False)], cursor, limit, skip)
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
-    db_user = models.User(
-        email=user.email, username=user.username, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+def get_images(db: Session, cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    query = db.query(models.Image).options(selectinload(models.Image.objects))
+    return paginate(query, [(models.Image.id, False)], cursor, limit, skip)
 
 
-def get_images(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Image).offset(skip).limit(limit).all()
+def get_images_by_user(db: Session, user_id: int, cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    query = db.query(models.Image).options(selectinload(models.Image.objects)).filter(models.Image.owner_id == user_id)
+    return paginate(query, [(models.Image.id, False)], cursor, limit, skip)
 
 
-def get_images_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Image).filter(models.Image.owner_id == user_id).offset(skip).limit(limit).all()
+def get_images_by_ids(db: Session, image_ids: list[int]):
+    return db.query(models.Image).options(selectinload(models.Image.objects)).filter(models.Image.id.in_(image_ids)).all()
 
 
 def get_image_by_path(db: Session, path: str):
     return db.query(models.Image).filter(models.Image.path == path).first()
 
 
-def create_user_image(db: Session, image: schemas.ImageCreate, user_id: int):
-    db_image = models.Image(**image.dict(), owner_id=user_id)
-    db.add(db_image)
+def get_user_images_by_hashes(db: Session, user_id: int, hashes: list[str]):
+    return db.query(models.Image).filter(models.Image.owner_id == user_id, models.Image.sha256.in_(hashes)).all()
+
+
+def get_classified_images_by_hashes(db: Session, hashes: list[str]):
+    # any already classified copy of the same bytes, regardless of owner
+    images = db.query(models.Image).options(selectinload(models.Image.objects), selectinload(models.Image.embedding)).filter(
+        models.Image.sha256.in_(hashes), models.Image.imported.isnot(True),
+        models.Image.objects.any(models.ImageObject.model_version == MODEL_VERSION)).all()
+    return {image.sha256: image for image in images}
+
+
+def get_user_phashes(db: Session, user_id: int):
+    return db.query(models.Image.id, models.Image.phash).filter(models.Image.owner_id == user_id, models.Image.phash.isnot(None)).all()
+
+
+def add_tags_to_index(db: Session, object: str, score: float | None, image_id: int, model_version: str | None = MODEL_VERSION):
+    for token in tokenize(object):
+        db.add(models.ImageTag(token=token, score=score, image_id=image_id, model_version=model_version))
+
+
+def tag_index_rows(object: str, score: float | None, image_id: int, model_version: str | None) -> list[dict]:
+    return [{"token": token, "score": score, "image_id": image_id, "model_version": model_version}
+            for token in tokenize(object)]
+
+
+def rebuild_tag_index(db: Session):
+    db.query(models.ImageTag).delete()
+    for object, score, image_id, model_version in db.query(models.ImageObject.object, models.ImageObject.score, models.ImageObject.image_id, models.ImageObject.model_version).yield_per(1000):
+        add_tags_to_index(db, object, score, image_id, model_version)
     db.commit()
-    db.refresh(db_image)
-    return db_image
+    response_cache.bump(response_cache.IMAGES)
+
+
+def is_tag_index_empty(db: Session):
+    return db.query(models.ImageTag.id).first() is None and db.query(models.ImageObject.id).first() is not None
+
+
+def tag_count_rows(user_id: int, objects_per_image: Iterable[Iterable[str]]) -> list[dict]:
+    # an image counts once per object even if the object is repeated
+    counts = Counter(object for objects in objects_per_image for object in set(objects))
+    return [{"owner_id": user_id, "object": object, "count": count} for object, count in counts.items()]
+
+
+def dialect_insert(dialect: str):
+    # INSERT ... ON CONFLICT is dialect specific in SQLAlchemy
+    return postgresql.insert if dialect == "postgresql" else sqlite.insert
+
+
+def upsert_tag_counts(dialect: str, rows: list[dict]):
+    statement = dialect_insert(dialect)(models.UserTagCount).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[models.UserTagCount.owner_id, models.UserTagCount.object],
+        set_={"count": models.UserTagCount.count + statement.excluded["count"]})
 
 
-def get_images_by_object(db: Session, object: str, skip: int = 0, limit: int = 100):
-    return db.query(models.Image).join(models.Image.objects).filter(models.ImageObject.object.like(f"%{object}%")).offset(skip).limit(limit).all()
+def increment_tag_counts(db: Session, user_id: int, objects_per_image: Iterable[Iterable[str]]):
+    rows = tag_count_rows(user_id, objects_per_image)
+    if rows:
+        db.execute(upsert_tag_counts(db.get_bind().dialect.name, rows))
 
 
-def add_object_to_image(db: Session, object: str, image_id: int):
-    db_object = models.ImageObject(object=object, image_id=image_id)
-    db.add(db_object)
+def rebuild_tag_counts(db: Session):
+    db.query(models.UserTagCount).delete()
+    counts = select(models.Image.owner_id, models.ImageObject.object, func.count(func.distinct(models.ImageObject.image_id))).join(
+        models.Image, models.Image.id == models.ImageObject.image_id).group_by(models.Image.owner_id, models.ImageObject.object)
+    db.execute(insert(models.UserTagCount).from_select(["owner_id", "object", "count"], counts))
     db.commit()
+
+
+def is_tag_counts_empty(db: Session):
+    return db.query(models.UserTagCount.owner_id).first() is None and db.query(models.ImageObject.id).first() is not None
+
+
+def get_user_tag_counts(db: Session, user_id: int, limit: int | None = None):
+    query = db.query(models.UserTagCount).filter(models.UserTagCount.owner_id == user_id).order_by(
+        models.UserTagCount.count.desc(), models.UserTagCount.object)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def search_images_by_tags(db: Session, query: str, match_all: bool = True, min_score: float = 0.0):
+    # every query word is a prefix match against the tag index; images are
+    # ranked by the number of matched words and then by their best score
+    terms = tokenize(query)
+    if not terms:
+        return None
+    # tags stored before scores existed have none, they rank as 0
+    score = func.coalesce(models.ImageTag.score, 0.0)
+    selects = [
+        select(models.ImageTag.image_id, score.label("score"), literal(i).label("term")).where(
+            models.ImageTag.token >= term, models.ImageTag.token < prefix_upper_bound(term), score >= min_score)
+        for i, term in enumerate(terms)
+    ]
+    if SEARCH_MODEL_VERSION:
+        selects = [select.where(models.ImageTag.model_version.in_([SEARCH_MODEL_VERSION, MANUAL_VERSION]))
+                   for select in selects]
+    matches = (selects[0] if len(selects) == 1 else union_all(*selects)).subquery()
+    matched = func.count(func.distinct(matches.c.term)).label("matched")
+    ranked = select(matches.c.image_id, matched, func.max(matches.c.score).label("score")).group_by(matches.c.image_id)
+    if match_all:
+        ranked = ranked.having(matched == len(terms))
+    ranked = ranked.subquery()
+    query = db.query(models.Image).options(selectinload(models.Image.objects)).join(ranked, ranked.c.image_id == models.Image.id)
+    return query, [(ranked.c.matched, True), (ranked.c.score, True), (models.Image.id, False)]
+
+
+def get_images_by_object(db: Session, object: str, match_all: bool = True, min_score: float = 0.0, cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    search = search_images_by_tags(db, object, match_all=match_all, min_score=min_score)
+    if search is None:
+        return Page([])
+    query, keys = search
+    return paginate(query, keys, cursor, limit, skip)
+
+
+def add_object_to_image(db: Session, object: str, db_image: models.Image, score: float = 1.0):
+    image_id, owner_id = db_image.id, db_image.owner_id
+    objects = db.query(models.ImageObject).filter(models.ImageObject.image_id == image_id, models.ImageObject.object == object).all()
+    if not objects:
+        increment_tag_counts(db, owner_id, [[object]])
+    log_change(db, owner_id, IMAGE, image_id, UPDATE)
+    db_object = next((db_object for db_object in objects if db_object.model_version == MANUAL_VERSION), None)
+    if db_object is not None:
+        # adding a manual object again updates its score
+        db_object.score = score
+        db.query(models.ImageTag).filter(models.ImageTag.image_id == image_id, models.ImageTag.model_version == MANUAL_VERSION,
+                                         models.ImageTag.token.in_(tokenize(object))).update({"score": score})
+    else:
+        db_object = models.ImageObject(object=object, score=score, image_id=image_id, model_version=MANUAL_VERSION)
+        db.add(db_object)
+        add_tags_to_index(db, object, score, image_id, MANUAL_VERSION)
+    db.commit()
+    response_cache.bump(response_cache.IMAGES)
     db.refresh(db_object)
     return db_object
 
 
-def create_image_with_objects(db: Session, image: schemas.ImageCreate, user_id: int, objects: list[str]):
-    db_image = models.Image(**image.dict(), owner_id=user_id)
-    db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
-    for object in objects:
-        db_object = models.ImageObject(object=object, image_id=db_image.id)
+def add_objects_to_image(db: Session, db_image: models.Image, objects: list[tuple[str, float]], embedding: bytes | None = None, phash: str | None = None):
+    if phash is not None:
+        db_image.phash = phash
+    existing = {db_object.object for db_object in db_image.objects}
+    increment_tag_counts(db, db_image.owner_id, [
+        [object for object, _ in objects if object not in existing]])
+    for object, score in objects:
+        db_object = models.ImageObject(
+            object=object, score=score, image_id=db_image.id, model_version=MODEL_VERSION)
         db.add(db_object)
+        add_tags_to_index(db, object, score, db_image.id)
+    if embedding is not None:
+        db.merge(models.ImageEmbedding(image_id=db_image.id, vector=embedding))
+    log_change(db, db_image.owner_id, IMAGE, db_image.id, UPDATE)
     db.commit()
+    response_cache.bump(response_cache.IMAGES)
     db.refresh(db_image)
     return db_image
 
 
-def get_own_images_by_object(db: Session, object: str, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Image).join(models.Image.objects).filter(models.ImageObject.object.like(f"%{object}%"), models.Image.owner_id == user_id).offset(skip).limit(limit).all()
+def classification_rows(db_images: list[models.Image], images: list[tuple[schemas.ImageCreate, list[tuple[str, float]], bytes | None]]):
+    # bulk insert parameters for the objects, tag index rows, embeddings and
+    # change log entries of freshly flushed images
+    object_rows, tag_rows, embedding_rows, changes = [], [], [], []
+    for db_image, (_, objects, embedding) in zip(db_images, images):
+        changes.extend(change_rows(db_image.owner_id, IMAGE, [db_image.id], INSERT))
+        for object, score in objects:
+            object_rows.append(
+                {"object": object, "score": score, "image_id": db_image.id, "model_version": MODEL_VERSION})
+            tag_rows.extend(tag_index_rows(object, score, db_image.id, MODEL_VERSION))
+        if embedding is not None:
+            embedding_rows.append({"image_id": db_image.id, "vector": embedding})
+    return [(model, rows) for model, rows in ((models.ImageObject, object_rows), (models.ImageTag, tag_rows), (models.ImageEmbedding, embedding_rows), (models.Change, changes)) if rows]
+
+
+def get_unclassified_images(db: Session):
+    return db.query(models.Image).filter(~models.Image.objects.any()).order_by(models.Image.id).all()
+
+
+def create_job(db: Session, image_id: int):
+    db_job = models.ClassificationJob(image_id=image_id)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def get_job(db: Session, job_id: int):
+    return db.query(models.ClassificationJob).filter(models.ClassificationJob.id == job_id).first()
+
+
+def update_job(db: Session, job_id: int, status: str, error: str | None = None):
+    db.query(models.ClassificationJob).filter(models.ClassificationJob.id == job_id).update(
+        {"status": status, "error": error})
+    db.commit()
+
+
+def finish_image_jobs(db: Session, image_id: int):
+    db.query(models.ClassificationJob).filter(models.ClassificationJob.image_id == image_id, models.ClassificationJob.status != "done").update(
+        {"status": "done", "error": None})
+    db.commit()
+
+
+def get_last_change_id(db: Session) -> int:
+    return db.query(func.max(models.Change.id)).scalar() or 0
+
+
+def get_changed_embeddings(db: Session, after_change_id: int, until_change_id: int):
+    changed = select(models.Change.entity_id).where(
+        models.Change.id > after_change_id, models.Change.id <= until_change_id, models.Change.entity == IMAGE)
+    return db.query(models.ImageEmbedding.image_id, models.Image.owner_id, models.ImageEmbedding.vector).join(
+        models.ImageEmbedding.image).filter(models.ImageEmbedding.image_id.in_(changed)).all()
+
+
+def get_embeddings(db: Session):
+    return db.query(models.ImageEmbedding.image_id, models.Image.owner_id, models.ImageEmbedding.vector).join(models.ImageEmbedding.image).yield_per(1000)
+
+
+def get_images_after(db: Session, after_id: int, limit: int):
+    # keyset-ordered chunk of (id, sha256) for batch jobs
+    return db.query(models.Image.id, models.Image.sha256).filter(models.Image.id > after_id).order_by(models.Image.id).limit(limit).all()
+
+
+def get_checkpoint(db: Session, model_version: str):
+    return db.get(models.ReclassificationCheckpoint, model_version)
+
+
+def save_reclassification(db: Session, model_version: str, results: list[tuple[int, list[tuple[str, float]], bytes | None]], last_image_id: int):
+    # the objects and tags of model_version are replaced and the checkpoint
+    # moves in the same transaction, so a rerun repeats at most the chunk
+    # that was interrupted and objects no longer predicted do not linger
+    dialect = db.get_bind().dialect.name
+    image_ids = [image_id for image_id, _, _ in results]
+    db.query(models.ImageObject).filter(models.ImageObject.image_id.in_(image_ids), models.ImageObject.model_version == model_version).delete()
+    object_rows = [{"image_id": image_id, "object": object, "score": score, "model_version": model_version}
+                   for image_id, objects, _ in results for object, score in objects]
+    if object_rows:
+        db.execute(insert(models.ImageObject), object_rows)
+    db.query(models.ImageTag).filter(models.ImageTag.image_id.in_(image_ids), models.ImageTag.model_version == model_version).delete()
+    tag_rows = [row for image_id, objects, _ in results for object, score in objects
+                for row in tag_index_rows(object, score, image_id, model_version)]
+    if tag_rows:
+        db.execute(insert(models.ImageTag), tag_rows)
+    embedding_rows = [{"image_id": image_id, "vector": embedding}
+                      for image_id, _, embedding in results if embedding is not None]
+    if embedding_rows:
+        statement = dialect_insert(dialect)(models.ImageEmbedding).values(embedding_rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[models.ImageEmbedding.image_id], set_={"vector": statement.excluded.vector}))
+    if image_ids:
+        owners = db.query(models.Image.id, models.Image.owner_id).filter(models.Image.id.in_(image_ids))
+        db.execute(insert(models.Change), [change_rows(owner_id, IMAGE, [image_id], UPDATE)[0] for image_id, owner_id in owners])
+    checkpoint = get_checkpoint(db, model_version) or models.ReclassificationCheckpoint(
+        model_version=model_version, last_image_id=0, processed=0)
+    checkpoint.last_image_id = last_image_id
+    checkpoint.processed += len(results)
+    db.add(checkpoint)
+    db.commit()
+    response_cache.bump(response_cache.IMAGES)
+
+
+def prune_model_versions(db: Session, model_version: str) -> int:
+    # drops classifications of every other model, manual objects stay
+    keep = [model_version, MANUAL_VERSION]
+    stale = or_(models.ImageObject.model_version.is_(None), models.ImageObject.model_version.notin_(keep))
+    changed = select(models.Image.owner_id, literal(IMAGE), models.Image.id, literal(UPDATE)).where(
+        models.Image.id.in_(select(models.ImageObject.image_id).where(stale)))
+    db.execute(insert(models.Change).from_select(["owner_id", "entity", "entity_id", "action"], changed))
+    deleted = db.query(models.ImageObject).filter(stale).delete(synchronize_session=False)
+    db.query(models.ImageTag).filter(
+        or_(models.ImageTag.model_version.is_(None), models.ImageTag.model_version.notin_(keep))).delete(synchronize_session=False)
+    db.commit()
+    rebuild_tag_counts(db)
+    response_cache.bump(response_cache.IMAGES)
+    return deleted
+
+
+def get_own_images_by_object(db: Session, object: str, user_id: int, match_all: bool = True, min_score: float = 0.0, cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    search = search_images_by_tags(db, object, match_all=match_all, min_score=min_score)
+    if search is None:
+        return Page([])
+    query, keys = search
+    return paginate(query.filter(models.Image.owner_id == user_id), keys, cursor, limit, skip)
+
+
+def album_query(db: Session, expand: Sequence[str] = ()):
+    query = db.query(models.Album)
+    if "images" in expand:
+        query = query.options(selectinload(models.Album.images).selectinload(models.Image.objects))
+    return query
 
 
-def get_albums(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Album).offset(skip).limit(limit).all()
+def get_albums(db: Session, cursor: str | None = None, limit: int = 100, expand: Sequence[str] = (), skip: int = 0) -> Page:
+    return paginate(album_query(db, expand), [(models.Album.id, False)], cursor, limit, skip)
 
 
-def get_own_albums(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Album).filter(models.Album.owner_id == user_id).offset(skip).limit(limit).all()
+def get_own_albums(db: Session, user_id: int, cursor: str | None = None, limit: int = 100, expand: Sequence[str] = (), skip: int = 0) -> Page:
+    query = album_query(db, expand).filter(models.Album.owner_id == user_id)
+    return paginate(query, [(models.Album.id, False)], cursor, limit, skip)
 
 
 def get_album_by_name(db: Session, name: str):
@@ -94,7 +534,10 @@ def get_album_by_name(db: Session, name: str):
 def create_album(db: Session, album: schemas.AlbumCreate, user_id: int):
     db_album = models.Album(**album.dict(), owner_id=user_id)
     db.add(db_album)
+    db.flush()
+    log_change(db, user_id, ALBUM, db_album.id, INSERT)
     db.commit()
+    response_cache.bump(response_cache.ALBUMS)
     db.refresh(db_album)
     return db_album
 
@@ -113,18 +556,23 @@ def add_image_to_album(db: Session, album_id: int, image_id: int):
     db_image = db.query(models.Image).filter(
         models.Image.id == image_id).first()
     db_album.images.append(db_image)
+    log_change(db, db_album.owner_id, ALBUM, db_album.id, UPDATE)
     db.commit()
+    response_cache.bump(response_cache.ALBUMS)
     db.refresh(db_album)
     return db_album
 
 
-def get_own_favorite_images(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Favorite).filter(models.Favorite.owner_id == user_id).offset(skip).limit(limit).all()
+def get_own_favorite_images(db: Session, user_id: int, cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    query = db.query(models.Favorite).filter(models.Favorite.owner_id == user_id)
+    return paginate(query, [(models.Favorite.id, False)], cursor, limit, skip)
 
 
 def add_image_to_favorites(db: Session, image_id: int, user_id: int):
     db_favorite = models.Favorite(image_id=image_id, owner_id=user_id)
     db.add(db_favorite)
+    db.flush()
+    log_change(db, user_id, FAVORITE, db_favorite.id, INSERT)
     db.commit()
     db.refresh(db_favorite)
     return db_favorite
@@ -0,0 +1,94 @@
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import models
+import response_cache
+import schemas
+from crud import IMAGE, INSERT, classification_rows, tag_count_rows, upsert_tag_counts
+from config import MODEL_VERSION
+from metrics import stage_seconds, timer
+
+# async variants of the crud functions used by the async upload and login handlers
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).filter(models.User.email == email))
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).filter(models.User.username == username))
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    # a new user owns nothing yet, empty collections avoid lazy loads on serialization
+    db_user = models.User(
+        email=user.email, username=user.username, hashed_password=hashed_password,
+        images=[], albums=[], favorites=[])
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+
+async def update_password_hash(db: AsyncSession, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    await db.commit()
+    return user
+
+
+async def get_user_images_by_hashes(db: AsyncSession, user_id: int, hashes: list[str]):
+    result = await db.scalars(select(models.Image).filter(models.Image.owner_id == user_id, models.Image.sha256.in_(hashes)))
+    return result.all()
+
+
+async def get_classified_images_by_hashes(db: AsyncSession, hashes: list[str]):
+    # any already classified copy of the same bytes, regardless of owner
+    result = await db.scalars(select(models.Image).options(selectinload(models.Image.objects), selectinload(models.Image.embedding)).filter(
+        models.Image.sha256.in_(hashes), models.Image.imported.isnot(True),
+        models.Image.objects.any(models.ImageObject.model_version == MODEL_VERSION)))
+    return {image.sha256: image for image in result.all()}
+
+
+async def get_images_by_ids(db: AsyncSession, image_ids: list[int]):
+    result = await db.scalars(select(models.Image).options(selectinload(models.Image.objects)).filter(models.Image.id.in_(image_ids)))
+    images = {image.id: image for image in result.all()}
+    return [images[image_id] for image_id in image_ids]
+
+
+async def create_user_image(db: AsyncSession, image: schemas.ImageCreate, user_id: int):
+    db_image = models.Image(**image.dict(), owner_id=user_id)
+    db.add(db_image)
+    await db.flush()
+    db.add(models.Change(owner_id=user_id, entity=IMAGE, entity_id=db_image.id, action=INSERT))
+    await db.commit()
+    response_cache.bump(response_cache.IMAGES)
+    return db_image
+
+
+async def create_job(db: AsyncSession, image_id: int):
+    db_job = models.ClassificationJob(image_id=image_id, status="queued")
+    db.add(db_job)
+    await db.commit()
+    return db_job
+
+
+async def create_images_with_objects(db: AsyncSession, images: list[tuple[schemas.ImageCreate, list[tuple[str, float]], bytes | None]], user_id: int):
+    # inserts all images and their objects in a single transaction
+    db_images = [models.Image(**image.dict(), owner_id=user_id)
+                 for image, _, _ in images]
+    with timer(stage_seconds, stage="db"):
+        db.add_all(db_images)
+        await db.flush()
+        for model, rows in classification_rows(db_images, images):
+            await db.execute(insert(model), rows)
+        rows = tag_count_rows(user_id, [[object for object, _ in objects] for _, objects, _ in images])
+        if rows:
+            await db.execute(upsert_tag_counts(db.get_bind().dialect.name, rows))
+        await db.commit()
+    response_cache.bump(response_cache.IMAGES)
+    return await get_images_by_ids(db, [db_image.id for db_image in db_images])
+
+
+async def create_image_with_objects(db: AsyncSession, image: schemas.ImageCreate, user_id: int, objects: list[tuple[str, float]], embedding: bytes | None = None):
+    db_images = await create_images_with_objects(db, [(image, objects, embedding)], user_id)
+    return db_images[0]
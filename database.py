@@ -1,13 +1,94 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+from config import (ASYNC_DATABASE_URL, DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_SIZE,
+                    SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE)
+from metrics import count_query
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+# advisory lock key held by transactions that write the change log
+CHANGE_LOG_LOCK = 7241
+
+
+def async_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside a writer, busy_timeout makes concurrent
+    # writers wait instead of failing with "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    count_query(time.perf_counter() - conn.info["query_start"].pop())
+
+
+def discard_query_timer(context):
+    # failed statements never reach after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def lock_change_log(conn, cursor, statement, parameters, context, executemany):
+    # change ids are the sync tokens of /users/me/changes, so they must become
+    # visible in id order: a client that has seen id N+1 would never get a
+    # later committed N. Writers of the log take a transaction-scoped lock
+    # before the insert assigns their ids and hold it until they commit.
+    # SQLite needs none, it only ever has one writing transaction.
+    if statement.startswith("INSERT INTO changes"):
+        cursor.execute(f"SELECT pg_advisory_xact_lock({CHANGE_LOG_LOCK})")
+
+
+def configure(engine: Engine, url: str):
+    if is_sqlite(url):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    elif make_url(url).get_backend_name() == "postgresql":
+        event.listen(engine, "before_cursor_execute", lock_change_log)
+    event.listen(engine, "before_cursor_execute", start_query_timer)
+    event.listen(engine, "after_cursor_execute", stop_query_timer)
+    event.listen(engine, "handle_error", discard_query_timer)
+
 
 # connect_args={"check_same_thread": False} needed only for SQLite. It's not needed for other databases
+connect_args = {"check_same_thread": False} if is_sqlite(SQLALCHEMY_DATABASE_URL) else {}
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args,
+    pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True,
 )
+configure(engine, SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_SQLALCHEMY_DATABASE_URL = ASYNC_DATABASE_URL or async_url(SQLALCHEMY_DATABASE_URL)
+# aiosqlite opens a connection per checkout, pool sizing only applies to servers
+async_pool_args = {} if is_sqlite(ASYNC_SQLALCHEMY_DATABASE_URL) else {
+    "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_pre_ping": True}
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL, **async_pool_args)
+configure(async_engine.sync_engine, ASYNC_SQLALCHEMY_DATABASE_URL)
+# objects stay usable after commit, async sessions cannot lazily reload them
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
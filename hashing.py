@@ -0,0 +1,20 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def perceptual_hash(image: np.ndarray) -> str:
+    # dHash: one bit per horizontally adjacent pixel pair of a small grayscale
+    # thumbnail, so it survives re-encoding, resizing and value scaling
+    gray = np.asarray(image, dtype=np.float32).mean(axis=-1)
+    small = np.asarray(Image.fromarray(gray, mode='F').resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR))
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+
+def hamming_distances(hashes: list[str], phash: str) -> np.ndarray:
+    values = np.array([int(h, 16) for h in hashes], dtype=np.uint64)
+    diff = values ^ np.uint64(int(phash, 16))
+    return np.unpackbits(diff.view(np.uint8)).reshape(-1, 64).sum(axis=1)
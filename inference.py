@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+
+from metrics import Gauge, Histogram, timer
+
+batch_size = Histogram(
+    "inference_batch_size", "Images per model call", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+batch_seconds = Histogram(
+    "inference_batch_seconds", "Model call duration per batch")
+queue_depth = Gauge(
+    "inference_queue_depth", "Images waiting for the next batch")
+
+
+class InferenceScheduler:
+    # collects concurrent requests into batches and runs each batch through
+    # the model in one call on a dedicated thread, off the event loop
+
+    def __init__(
+        self,
+        predict: Callable[[np.ndarray], np.ndarray],
+        postprocess: Callable[[np.ndarray], Any],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10,
+    ):
+        self.predict = predict
+        self.postprocess = postprocess
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._buffer: np.ndarray | None = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="inference")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+        self._task = None
+        self._executor = None
+        # cancel requests that never made it into a batch
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def submit(self, image: np.ndarray):
+        if self._task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        queue_depth.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self) -> list[tuple[np.ndarray, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        queue_depth.set(self._queue.qsize())
+        batch_size.observe(len(batch))
+        return batch
+
+    def _batch(self, images: list[np.ndarray]) -> np.ndarray:
+        # reuse one preallocated input buffer instead of stacking every batch
+        shape = (self.max_batch_size, *images[0].shape)
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != images[0].dtype:
+            self._buffer = np.empty(shape, dtype=images[0].dtype)
+        batch = self._buffer[:len(images)]
+        for i, image in enumerate(images):
+            batch[i] = image
+        return batch
+
+    def _process(self, images: list[np.ndarray]) -> list[Any]:
+        with timer(batch_seconds):
+            predictions = self.predict(self._batch(images))
+        return [self.postprocess(prediction) for prediction in predictions]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            images = [image for image, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._process, images)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import BinaryIO, Callable
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+import crud
+import labels
+from classifier import classify_file, classify_files
+from config import CLASSIFICATION_QUEUE_SIZE, CLASSIFICATION_WORKERS, INFERENCE_MAX_BATCH_SIZE, MODEL_VERSION, UPLOAD_SPOOL_DIR
+from database import SessionLocal
+from similarity import to_blob
+from storage import get_store
+from uploads import copy_upload
+
+
+def spool_path(image_id: int) -> str:
+    return os.path.join(UPLOAD_SPOOL_DIR, str(image_id))
+
+
+def spool_upload(image_id: int, file: BinaryIO) -> str:
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = spool_path(image_id)
+    copy_upload(file, path)
+    return path
+
+
+def create_pool(max_workers: int = CLASSIFICATION_WORKERS) -> ProcessPoolExecutor:
+    # spawn instead of fork: TensorFlow is not fork-safe once initialized
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=labels.load_labels,
+    )
+
+
+def save_classification(image_id: int, objects: list[tuple[str, float]], embedding: np.ndarray, phash: str):
+    db = SessionLocal()
+    try:
+        db_image = crud.add_objects_to_image(
+            db, crud.get_image(db, image_id), objects, to_blob(embedding), phash)
+        crud.finish_image_jobs(db, image_id)
+        return db_image.id, db_image.owner_id
+    finally:
+        db.close()
+
+
+def update_job(job_id: int, status: str, error: str | None = None):
+    db = SessionLocal()
+    try:
+        crud.update_job(db, job_id, status, error)
+    finally:
+        db.close()
+
+
+class ClassificationJobs:
+    # runs classification of spooled uploads on a process pool so decoding
+    # and inference never compete with request handling
+
+    def __init__(
+        self,
+        on_classified: Callable[[int, int, np.ndarray], None],
+        max_workers: int = CLASSIFICATION_WORKERS,
+        max_pending: int = CLASSIFICATION_QUEUE_SIZE,
+    ):
+        self.on_classified = on_classified
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool: ProcessPoolExecutor | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        if self._pool is None:
+            self._pool = create_pool(self.max_workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def is_full(self) -> bool:
+        return len(self._tasks) >= self.max_pending
+
+    def submit(self, job_id: int, image_id: int, sha256: str | None = None):
+        self.start()
+        task = asyncio.create_task(self._run(job_id, image_id, sha256))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: int, image_id: int, sha256: str | None):
+        loop = asyncio.get_running_loop()
+        path = spool_path(image_id)
+        await run_in_threadpool(update_job, job_id, "running")
+        try:
+            objects, embedding, phash = await loop.run_in_executor(self._pool, classify_file, path, sha256)
+            image_id, owner_id = await run_in_threadpool(
+                save_classification, image_id, objects, embedding, phash)
+        except asyncio.CancelledError:
+            # the spooled file is kept, so the backfill command can finish it
+            raise
+        except Exception as e:
+            await run_in_threadpool(update_job, job_id, "failed", str(e))
+            return
+        os.remove(path)
+        self.on_classified(image_id, owner_id, embedding)
+
+
+def backfill(max_workers: int = CLASSIFICATION_WORKERS):
+    # classifies images that have no ImageObject rows yet, e.g. uploads whose
+    # background job was interrupted by a restart
+    db = SessionLocal()
+    try:
+        hashes = {image.id: image.sha256 for image in crud.get_unclassified_images(db)}
+    finally:
+        db.close()
+    pending = [image_id for image_id in hashes
+               if os.path.exists(spool_path(image_id))]
+    print(f"{len(hashes)} unclassified images, {len(pending)} with a spooled upload")
+
+    with create_pool(max_workers) as pool:
+        futures = {pool.submit(classify_file, spool_path(image_id), hashes[image_id]): image_id
+                   for image_id in pending}
+        for future in as_completed(futures):
+            image_id = futures[future]
+            try:
+                objects, embedding, phash = future.result()
+            except Exception as e:
+                print(f"failed to classify image {image_id}: {e}")
+                continue
+            save_classification(image_id, objects, embedding, phash)
+            os.remove(spool_path(image_id))
+            print(f"classified image {image_id}: {', '.join(object for object, _ in objects)}")
+
+
+def reclassify(
+    model_version: str = MODEL_VERSION,
+    max_workers: int = CLASSIFICATION_WORKERS,
+    chunk_size: int = INFERENCE_MAX_BATCH_SIZE,
+    embeddings: bool = False,
+    prune: bool = False,
+    restart: bool = False,
+):
+    # recomputes the objects of every stored image with the configured model
+    # and writes them under model_version next to the previous ones; search
+    # can stay pinned to the old version (SEARCH_MODEL_VERSION) until it is done
+    store = get_store()
+    db = SessionLocal()
+    try:
+        checkpoint = crud.get_checkpoint(db, model_version)
+        after_id = checkpoint.last_image_id if checkpoint is not None and not restart else 0
+        print(f"reclassifying images after id {after_id} as {model_version!r}")
+        pending: deque[tuple[Future | None, list[int], int, int]] = deque()
+
+        def submit_next_chunk() -> bool:
+            nonlocal after_id
+            rows = crud.get_images_after(db, after_id, chunk_size)
+            if not rows:
+                return False
+            after_id = rows[-1].id
+            stored = [(image_id, store.original_path(sha256)) for image_id, sha256 in rows if sha256]
+            stored = [(image_id, path) for image_id, path in stored if path is not None]
+            future = pool.submit(classify_files, [path for _, path in stored]) if stored else None
+            pending.append((future, [image_id for image_id, _ in stored], after_id, len(rows)))
+            return True
+
+        processed = skipped = 0
+        with create_pool(max_workers) as pool:
+            # a few chunks in flight per worker; results are saved in id order
+            # so the checkpoint only ever moves past finished images
+            while len(pending) < max_workers * 2 and submit_next_chunk():
+                pass
+            while pending:
+                future, image_ids, last_image_id, total = pending.popleft()
+                outputs = future.result() if future is not None else []
+                results = [(image_id, output[0], to_blob(output[1]) if embeddings else None)
+                           for image_id, output in zip(image_ids, outputs) if output is not None]
+                crud.save_reclassification(db, model_version, results, last_image_id)
+                processed += len(results)
+                skipped += total - len(results)
+                print(f"up to image {last_image_id}: {processed} reclassified, {skipped} without a readable stored file")
+                submit_next_chunk()
+
+        crud.rebuild_tag_counts(db)
+        if prune:
+            deleted = crud.prune_model_versions(db, model_version)
+            print(f"removed {deleted} objects of other model versions")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background classification jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="classify images that have no objects yet")
+    backfill_parser.add_argument(
+        "--workers", type=int, default=CLASSIFICATION_WORKERS)
+    reclassify_parser = subparsers.add_parser(
+        "reclassify", help="recompute the objects of all stored images under a model version")
+    reclassify_parser.add_argument("--model-version", default=MODEL_VERSION)
+    reclassify_parser.add_argument(
+        "--workers", type=int, default=CLASSIFICATION_WORKERS)
+    reclassify_parser.add_argument(
+        "--chunk-size", type=int, default=INFERENCE_MAX_BATCH_SIZE, help="images per model call")
+    reclassify_parser.add_argument(
+        "--embeddings", action="store_true", help="also replace the similarity embeddings")
+    reclassify_parser.add_argument(
+        "--prune", action="store_true", help="delete objects of other model versions when done")
+    reclassify_parser.add_argument(
+        "--restart", action="store_true", help="ignore the checkpoint and start from the first image")
+    args = parser.parse_args()
+    if args.command == "backfill":
+        backfill(args.workers)
+    elif args.command == "reclassify":
+        reclassify(args.model_version, args.workers, args.chunk_size,
+                   embeddings=args.embeddings, prune=args.prune, restart=args.restart)
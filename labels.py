@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from config import LABELS_PATH
+
+NUM_CLASSES = 1000
+
+_labels: np.ndarray | None = None
+
+
+def read_labels_file(path: str) -> np.ndarray:
+    # each line is "<class_id> <label>", e.g. "1 goldfish"
+    labels = np.empty(NUM_CLASSES, dtype=object)
+    with open(path) as f:
+        for line in f:
+            parts = line.strip().split(' ', 1)
+            if len(parts) != 2 or not parts[0].isdigit():
+                continue
+            labels[int(parts[0])] = parts[1].strip().replace('_', ' ')
+    return labels
+
+
+def read_keras_labels() -> np.ndarray:
+    from tensorflow.keras.applications.imagenet_utils import decode_predictions
+
+    # one-hot rows make decode_predictions return the label of each class id
+    decoded = decode_predictions(np.eye(NUM_CLASSES), top=1)
+    return np.array([row[0][1].replace('_', ' ') for row in decoded], dtype=object)
+
+
+def load_labels(path: str = LABELS_PATH) -> np.ndarray:
+    global _labels
+    if os.path.exists(path):
+        _labels = read_labels_file(path)
+    else:
+        _labels = read_keras_labels()
+    return _labels
+
+
+def get_labels() -> np.ndarray:
+    if _labels is None:
+        return load_labels()
+    return _labels
+
+
+def top_k(prediction: np.ndarray, k: int, min_score: float = 0.0) -> list[tuple[str, float]]:
+    k = min(k, prediction.shape[-1])
+    class_ids = np.argpartition(prediction, -k)[-k:]
+    class_ids = class_ids[np.argsort(prediction[class_ids])[::-1]]
+    scores = prediction[class_ids]
+    # keep the best class even if it is below the threshold
+    keep = scores >= min_score
+    keep[0] = True
+    names = get_labels()[class_ids[keep]]
+    objects = {}
+    for name, score in zip(names, scores[keep]):
+        # some ImageNet labels repeat ("crane", "maillot"), scores are in
+        # descending order so the better class wins
+        if name and name not in objects:
+            objects[name] = float(score)
+    return list(objects.items())
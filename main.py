@@ -1,20 +1,43 @@
-import io
+import asyncio
+import mimetypes
+import time
 from datetime import datetime, timedelta
-from typing import List
+from typing import BinaryIO, List, Literal
 
 import numpy as np
-import tensorflow as tf
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile, status
+from fastapi import Depends, FastAPI, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from PIL import Image
-from schemas import Token, TokenData, User
+from schemas import Principal, Token, TokenData
 import crud
-from utils import verify_password
+from utils import get_password_hash_async, login_attempts, shutdown_pool, verify_password_async
+import auth_cache
+import classifier
 import crud
+import crud_async
+import labels
+import metrics
 import models
+import response_cache
 import schemas
-from database import SessionLocal, engine
+from classifier import decode_prediction, decode_upload, get_backend, predict_batch
+from config import (INFERENCE_MAX_BATCH_SIZE, MAX_CHANGES_PAGE_SIZE, INFERENCE_MAX_WAIT_MS, MAX_IMPORT_SIZE, MAX_REQUEST_SIZE, MODEL_PRELOAD, MODEL_VERSION, MODEL_WARMUP_BATCH_SIZES, PROFILER_ENABLED,
+                    THUMBNAIL_FORMAT, THUMBNAIL_SIZES)
+from database import AsyncSessionLocal, SessionLocal, engine
+from hashing import hamming_distances
+from inference import InferenceScheduler
+from jobs import ClassificationJobs, spool_upload
+from pagination import InvalidCursorError, Page
+from preprocessing import InvalidImageError
+from profiler import SamplingProfiler
+from responses import file_response
+from similarity import EMBEDDING_BYTES, SimilarityIndex, from_blob, to_blob
+from storage import THUMBNAIL_MEDIA_TYPES, create_thumbnail, get_store
+from transfer import InvalidImportError, LibraryImport, export_library, iter_records
+from uploads import UploadTooLargeError, hash_upload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 
@@ -35,16 +58,30 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def get_user(db, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def authenticate_user(db, username: str, password: str):
-    user = crud.get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await crud_async.get_user_by_username(db, username)
     if not user:
+        login_attempts.inc(result="unknown_user")
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password_async(password, user.hashed_password)
+    if not valid:
+        login_attempts.inc(result="invalid_password")
         return False
+    if new_hash:
+        # the stored hash uses an outdated cost or scheme, upgrade it while
+        # the plain password is at hand
+        await crud_async.update_password_hash(db, user, new_hash)
+        login_attempts.inc(result="rehashed")
+    login_attempts.inc(result="success")
     return user
 
 
@@ -65,56 +102,121 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    payload = auth_cache.get_token(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
+        auth_cache.cache_token(token, payload)
+    username: str = payload.get("sub")
+    if username is None:
         raise credentials_exception
-    user = get_user(db, username=token_data.username)
+    token_data = TokenData(username=username, user_id=payload.get("uid"))
+
+    if token_data.user_id is not None:
+        principal = auth_cache.get_user(token_data.user_id)
+        if principal is not None:
+            return principal
+        user = crud.get_user(db, user_id=token_data.user_id)
+    else:
+        # tokens issued before the user id was added to the claims
+        user = get_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_orm(user)
+    auth_cache.cache_user(principal)
+    return principal
 
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
-model = tf.keras.applications.MobileNetV2()
+similarity_index = SimilarityIndex()
+classification_jobs = ClassificationJobs(on_classified=similarity_index.add)
 
-# Преобразуем изображение в формат, который можно использовать в модели
+profiler = SamplingProfiler() if PROFILER_ENABLED else None
 
+inference_scheduler = InferenceScheduler(
+    predict_batch, decode_prediction,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS)
 
-def read_imagefile(file) -> np.ndarray:
-    image = Image.open(io.BytesIO(file))
-    image = image.convert('RGB')
-    image = image.resize((224, 224))
-    return np.array(image) / 255.0
 
+@app.on_event("startup")
+async def start_inference_scheduler():
+    await run_in_threadpool(labels.load_labels)
+    if MODEL_PRELOAD:
+        await run_in_threadpool(get_backend, MODEL_WARMUP_BATCH_SIZES)
+    await run_in_threadpool(build_tag_index)
+    await run_in_threadpool(load_similarity_index)
+    await inference_scheduler.start()
+    if profiler is not None:
+        profiler.start()
+    app.state.ready = True
 
-def get_objects_on_image(image: np.ndarray) -> list[str]:
-    prediction = model.predict(np.array([image]))
-    predicted_class = np.argmax(prediction, axis=-1)
-    # for each class in predicted_class read word from file imagenet_classes.txt and add to list
-    result = []
-    for class_id in predicted_class:
-        with open('imagenet_classes.txt') as f:
-            # if line starts with class_id then add to result
-            for line in f:
-                if line.startswith(str(class_id)):
-                    result.append(line.split(' ', 1)[
-                                  1].strip().replace('_', ' '))
-    return result
+
+@app.on_event("shutdown")
+async def stop_inference_scheduler():
+    await inference_scheduler.stop()
+    await classification_jobs.stop()
+    shutdown_pool()
+    if profiler is not None:
+        profiler.stop()
+
+
+def build_tag_index():
+    db = SessionLocal()
+    try:
+        # fill the search index for databases created before it existed
+        if crud.is_tag_index_empty(db):
+            crud.rebuild_tag_index(db)
+        if crud.is_tag_counts_empty(db):
+            crud.rebuild_tag_counts(db)
+        if crud.is_change_log_empty(db):
+            crud.rebuild_change_log(db)
+    finally:
+        db.close()
+
+
+def add_stored_embeddings(rows):
+    for image_id, owner_id, vector in rows:
+        # rows of another size cannot be read back (or compared)
+        if len(vector) == EMBEDDING_BYTES:
+            similarity_index.add(image_id, owner_id, from_blob(vector))
+
+
+def load_similarity_index():
+    db = SessionLocal()
+    try:
+        # taken first, so writes made during the load are picked up later
+        similarity_index.change_id = crud.get_last_change_id(db)
+        add_stored_embeddings(crud.get_embeddings(db))
+    finally:
+        db.close()
+
+
+def refresh_similarity_index(db: Session):
+    # other workers, background jobs and `jobs.py reclassify` store embeddings
+    # too; every such write is in the change log, so load what changed since
+    # the last refresh (a single max(id) lookup when nothing did)
+    last_change_id = crud.get_last_change_id(db)
+    if last_change_id > similarity_index.change_id:
+        add_stored_embeddings(crud.get_changed_embeddings(db, similarity_index.change_id, last_change_id))
+        similarity_index.change_id = max(similarity_index.change_id, last_change_id)
+
+
+async def classify_image(image: np.ndarray) -> tuple[list[tuple[str, float]], np.ndarray]:
+    # includes the wait for a batch slot
+    with metrics.timer(metrics.stage_seconds, stage="inference"):
+        return await inference_scheduler.submit(image)
 
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -123,37 +225,186 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.get("/users/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
+@app.get("/health")
+def read_health():
+    # liveness: the worker is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def read_ready(response: Response):
+    # readiness: startup has finished, which includes loading and warming up
+    # the model unless it is loaded lazily (MODEL_PRELOAD=0)
+    ready = getattr(app.state, "ready", False) and classifier.model_state in (
+        ("ready",) if MODEL_PRELOAD else ("ready", "not_loaded", "loading"))
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "not_ready", "model": classifier.model_state}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return metrics.render()
+
+
+if profiler is not None:
+    @app.get("/debug/profile", response_class=PlainTextResponse)
+    def read_profile(reset: bool = False):
+        return profiler.collapsed(reset=reset)
+
+
+@app.get("/users/me", response_model=Principal)
+async def read_users_me(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 
-@app.get("/users/me/images/")
-async def read_own_images(current_user: User = Depends(get_current_active_user)):
-    return current_user.images
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    queries = metrics.start_request_queries()
+    start = time.perf_counter()
+    response = await call_next(request)
+    # the route template keeps the label set small, unmatched paths share one
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.request_seconds.observe(
+        time.perf_counter() - start, method=request.method, route=path, status=response.status_code)
+    metrics.db_queries_per_request.observe(queries[0], route=path)
+    return response
+
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    # refuse oversized bodies from the declared length, before starlette
+    # spends time and disk spooling them
+    max_size = MAX_IMPORT_SIZE if request.url.path == "/users/me/import" else MAX_REQUEST_SIZE
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        return JSONResponse(status_code=413, content={"detail": f"Request is larger than {max_size} bytes"})
+    return await call_next(request)
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+def page_items(response: Response, page: Page) -> list:
+    # the cursor for the next page travels in a header so list bodies keep
+    # their shape; it is absent on the last page
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+
+def expand_fields(schema, obj, expand: list[str]):
+    # collections that were not requested are left unset (and out of the
+    # response) instead of being lazily loaded one row at a time
+    return schema(**{name: getattr(obj, name) for name in schema.__fields__
+                     if name not in schema.expandable or name in expand})
+
+
+@app.get("/users/me/images/", response_model=List[schemas.Image])
+def read_own_images(response: Response, current_user: Principal = Depends(get_current_active_user), cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), db: Session = Depends(get_db)):
+    page = crud.get_images_by_user(
+        db, user_id=current_user.id, cursor=cursor, limit=limit, skip=skip)
+    return page_items(response, page)
+
+
+@app.get("/users/me/tags", response_model=List[schemas.TagCount])
+def read_own_tags(current_user: Principal = Depends(get_current_active_user), limit: int | None = Query(None, ge=1), db: Session = Depends(get_db)):
+    # tags ordered by the number of images, ?limit= returns the top k
+    return crud.get_user_tag_counts(db, user_id=current_user.id, limit=limit)
+
+
+def compact_changes(changes: list[models.Change]) -> list[tuple[str, int, str]]:
+    # one entry per entity in the order of its last change; an entity created
+    # inside the window is reported as inserted even if it was updated since
+    latest: dict[tuple[str, int], str] = {}
+    for change in changes:
+        key = (change.entity, change.entity_id)
+        previous = latest.pop(key, None)
+        latest[key] = crud.INSERT if previous == crud.INSERT and change.action == crud.UPDATE else change.action
+    return [(entity, entity_id, action) for (entity, entity_id), action in latest.items()]
+
+
+@app.get("/users/me/changes", response_model=schemas.ChangeSet, response_model_exclude_none=True)
+def read_own_changes(current_user: Principal = Depends(get_current_active_user), since: str = "0", limit: int = 500, db: Session = Depends(get_db)):
+    if not since.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    changes, has_more = crud.get_changes(
+        db, user_id=current_user.id, since=int(since), limit=max(1, min(limit, MAX_CHANGES_PAGE_SIZE)))
+    compacted = compact_changes(changes)
+
+    def ids(entity: str) -> list[int]:
+        return [entity_id for kind, entity_id, action in compacted if kind == entity and action != crud.DELETE]
+
+    # current state of every changed entity, one query per entity type
+    images = {image.id: schemas.Image.from_orm(image) for image in crud.get_images_for_sync(db, ids(crud.IMAGE))}
+    albums = {album.id: schemas.AlbumSync(**schemas.AlbumInfo.from_orm(album).dict(), image_ids=image_ids)
+              for album, image_ids in crud.get_albums_for_sync(db, ids(crud.ALBUM))}
+    favorites = {favorite.id: schemas.Favorite.from_orm(favorite) for favorite in crud.get_favorites_for_sync(db, ids(crud.FAVORITE))}
+    found = {crud.IMAGE: images, crud.ALBUM: albums, crud.FAVORITE: favorites}
+
+    result = []
+    for entity, entity_id, action in compacted:
+        data = found[entity].get(entity_id)
+        if data is None:
+            # gone since it was logged
+            result.append(schemas.Change(entity=entity, id=entity_id, action=crud.DELETE))
+        else:
+            result.append(schemas.Change(entity=entity, id=entity_id, action=action, **{entity: data}))
+    token = str(changes[-1].id) if changes else since
+    return schemas.ChangeSet(changes=result, token=token, has_more=has_more)
+
+
+@app.get("/users/me/export")
+def export_own_library(current_user: Principal = Depends(get_current_active_user), embeddings: bool = True):
+    return StreamingResponse(export_library(current_user.id, embeddings), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="library.ndjson"'})
+
+
+def add_imported_embedding(image_id: int, owner_id: int, vector: bytes):
+    similarity_index.add(image_id, owner_id, from_blob(vector))
+
+
+@app.post("/users/me/import", response_model=schemas.ImportResult)
+async def import_own_library(request: Request, current_user: Principal = Depends(get_current_active_user)):
+    # the body is the NDJSON of an export, written chunk by chunk while it is
+    # received; a failed import can be sent again, images already imported
+    # are matched by sha256
+    library_import = LibraryImport(current_user.id, on_image=add_imported_embedding)
+    try:
+        async for record in iter_records(request.stream()):
+            if library_import.add(record):
+                await run_in_threadpool(library_import.flush)
+        await run_in_threadpool(library_import.flush)
+    except InvalidImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return library_import.result
 
 
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     print(user)
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud_async.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400,
                             detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await get_password_hash_async(user.password)
+    return await crud_async.create_user(db=db, user=user, hashed_password=hashed_password)
 
 
-@app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db=db, skip=skip, limit=limit)
-    for user in users:
-        print(user)
-    return users
+@app.get("/users/", response_model=List[schemas.UserList], response_model_exclude_unset=True)
+def read_users(response: Response, cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), expand: list[Literal["images", "albums", "favorites"]] = Query([]), db: Session = Depends(get_db)):
+    users = crud.get_users(db=db, cursor=cursor, limit=limit, skip=skip, expand=expand)
+    return [expand_fields(schemas.UserList, user, expand) for user in page_items(response, users)]
 
 
 @app.get("/users/{user_id}", response_model=schemas.User)
@@ -164,87 +415,314 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
     return db_user
 
 
+def copy_classification(source: models.Image) -> tuple[list[tuple[str, float]], bytes | None]:
+    # only what the current model predicted: manual objects belong to the
+    # source's owner and objects of other versions are stale
+    objects = [(db_object.object, db_object.score) for db_object in source.objects
+               if db_object.model_version == MODEL_VERSION]
+    embedding = source.embedding.vector if source.embedding is not None else None
+    return objects, embedding
+
+
 @app.post("/users/{user_id}/images/", response_model=schemas.Image)
 async def create_image_for_user(
     user_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    background: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 
 
 ):
-    image = schemas.ImageCreate(path=file.filename)
-    db_image = crud.get_image_by_path(db, path=image.path)
-    if db_image:
+    # the upload is never read into memory as a whole, every step streams
+    # from the spooled temp file starlette parsed it into
+    try:
+        sha256 = await run_in_threadpool(hash_upload, file.file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    image = schemas.ImageCreate(path=file.filename, sha256=sha256)
+    if await crud_async.get_user_images_by_hashes(db, user_id=user_id, hashes=[image.sha256]):
         raise HTTPException(status_code=400, detail="Image already exists")
+    store = get_store()
+
+    cached = await crud_async.get_classified_images_by_hashes(db, [image.sha256])
+    if image.sha256 in cached:
+        # identical bytes were classified before, skip decoding and inference
+        source = cached[image.sha256]
+        image.phash = source.phash
+        objects, embedding = copy_classification(source)
+        await run_in_threadpool(store.save_original, image.sha256, file.file)
+        db_image = await crud_async.create_image_with_objects(
+            db=db, image=image, user_id=user_id, objects=objects, embedding=embedding)
+        if embedding is not None:
+            similarity_index.add(db_image.id, db_image.owner_id, from_blob(embedding))
+        return db_image
+
+    if background:
+        if classification_jobs.is_full():
+            raise HTTPException(status_code=503, detail="Classification queue is full")
+        await run_in_threadpool(store.save_original, image.sha256, file.file)
+        db_image = await crud_async.create_user_image(db=db, image=image, user_id=user_id)
+        await run_in_threadpool(spool_upload, db_image.id, file.file)
+        db_job = await crud_async.create_job(db, image_id=db_image.id)
+        classification_jobs.submit(db_job.id, db_image.id, image.sha256)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=schemas.Job.from_orm(db_job).dict())
 
-    image_nd = read_imagefile(await file.read())
-    objects = get_objects_on_image(image_nd)
-    return crud.create_image_with_objects(db=db, image=image, user_id=user_id, objects=objects)
+    try:
+        image_nd, image.phash = await run_in_threadpool(decode_upload, file.file, image.sha256)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read image: {e}")
+    await run_in_threadpool(store.save_original, image.sha256, file.file)
+    objects, embedding = await classify_image(image_nd)
+    db_image = await crud_async.create_image_with_objects(
+        db=db, image=image, user_id=user_id, objects=objects, embedding=to_blob(embedding))
+    similarity_index.add(db_image.id, db_image.owner_id, embedding)
+    return db_image
+
+
+@app.post("/users/{user_id}/images/batch", response_model=List[schemas.ImageUploadResult])
+async def create_images_for_user(
+    user_id: int,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    results = [schemas.ImageUploadResult(path=file.filename, status="created")
+               for file in files]
+    async def hash_file(file: UploadFile):
+        try:
+            return await run_in_threadpool(hash_upload, file.file)
+        except UploadTooLargeError as e:
+            return e
+
+    hashes = await asyncio.gather(*(hash_file(file) for file in files))
+    for result, sha256 in zip(results, hashes):
+        if isinstance(sha256, Exception):
+            result.status = "too_large"
+            result.detail = str(sha256)
+    hashes = [sha256 if isinstance(sha256, str) else None for sha256 in hashes]
+    existing = {db_image.sha256 for db_image in await crud_async.get_user_images_by_hashes(
+        db, user_id=user_id, hashes=list(set(hashes) - {None}))}
+    cached = await crud_async.get_classified_images_by_hashes(db, list(set(hashes) - existing - {None}))
+
+    seen = set()
+    new_images = []
+    to_decode = []
+    for result, file, sha256 in zip(results, files, hashes):
+        if sha256 is None:
+            continue
+        elif sha256 in existing:
+            result.status = "exists"
+            result.detail = "Image already exists"
+        elif sha256 in seen:
+            result.status = "duplicate"
+            result.detail = "Image is repeated in the request"
+        elif sha256 in cached:
+            seen.add(sha256)
+            image = schemas.ImageCreate(
+                path=result.path, sha256=sha256, phash=cached[sha256].phash)
+            new_images.append((result, image, *copy_classification(cached[sha256])))
+        else:
+            seen.add(sha256)
+            to_decode.append((result, schemas.ImageCreate(
+                path=result.path, sha256=sha256), file.file))
+
+    async def decode(file: BinaryIO, sha256: str):
+        try:
+            return await run_in_threadpool(decode_upload, file, sha256)
+        except InvalidImageError as e:
+            return e
+
+    decoded_images = await asyncio.gather(*(decode(file, image.sha256) for _, image, file in to_decode))
+    decoded = []
+    for (result, image, _), decoded_image in zip(to_decode, decoded_images):
+        if isinstance(decoded_image, Exception):
+            result.status = "invalid"
+            result.detail = "Cannot read image"
+        else:
+            image_nd, image.phash = decoded_image
+            decoded.append((result, image, image_nd))
+
+    # submitted together, the images are classified in as few batches as possible
+    classified = await asyncio.gather(*(classify_image(image_nd) for _, _, image_nd in decoded))
+    for (result, image, _), (objects, embedding) in zip(decoded, classified):
+        new_images.append((result, image, objects, to_blob(embedding)))
+    if not new_images:
+        return results
+
+    store = get_store()
+    stored = {image.sha256 for _, image, _, _ in new_images}
+    originals = {sha256: file.file for file, sha256 in zip(files, hashes) if sha256 in stored}
+    await asyncio.gather(*(run_in_threadpool(store.save_original, sha256, file)
+                           for sha256, file in originals.items()))
+    db_images = await crud_async.create_images_with_objects(db, [
+        (image, objects, embedding) for _, image, objects, embedding in new_images
+    ], user_id=user_id)
+    for (result, _, _, embedding), db_image in zip(new_images, db_images):
+        if embedding is not None:
+            similarity_index.add(db_image.id, db_image.owner_id, from_blob(embedding))
+        result.image = schemas.Image.from_orm(db_image)
+    return results
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.Job)
+def read_job(job_id: int, db: Session = Depends(get_db)):
+    db_job = crud.get_job(db, job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return db_job
 
 
 @app.get("/images/", response_model=List[schemas.Image])
-def read_images(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    images = crud.get_images(db, skip=skip, limit=limit)
-    for image in images:
-        print(image)
-    return images
+def read_images(request: Request, cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), db: Session = Depends(get_db)):
+    def build():
+        images = crud.get_images(db, cursor=cursor, limit=limit, skip=skip)
+        return [schemas.Image.from_orm(image) for image in images.items], images.next_cursor
+    return response_cache.cached_response(request, [response_cache.IMAGES], build)
 
 
 @app.post("/images/{image_id}/objects", response_model=schemas.ImageObject)
 def add_object_to_image(
-    image_id: int, object: str, db: Session = Depends(get_db)
+    image_id: int, object: str, score: float = 1.0, db: Session = Depends(get_db)
+):
+    db_image = crud.get_image(db, image_id)
+    if db_image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return crud.add_object_to_image(db=db, object=object, db_image=db_image, score=score)
+
+
+@app.get("/images/{image_id}/similar", response_model=List[schemas.SimilarImage])
+def read_similar_images(
+    image_id: int, k: int = 10, current_user: Principal = Depends(get_current_active_user), db: Session = Depends(get_db)
+):
+    db_image = crud.get_image(db, image_id)
+    if db_image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # check if image belongs to user
+    if db_image.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    refresh_similarity_index(db)
+    similar = similarity_index.search(
+        image_id, owner_id=current_user.id, k=k)
+    images = {image.id: image for image in crud.get_images_by_ids(
+        db, [similar_id for similar_id, _ in similar])}
+    return [schemas.SimilarImage(**schemas.Image.from_orm(images[similar_id]).dict(), score=score)
+            for similar_id, score in similar if similar_id in images]
+
+
+@app.get("/images/{image_id}/duplicates", response_model=List[schemas.DuplicateImage])
+def read_duplicate_images(
+    image_id: int, max_distance: int = 6, current_user: Principal = Depends(get_current_active_user), db: Session = Depends(get_db)
 ):
-    return crud.add_object_to_image(db=db, object=object, image_id=image_id)
+    db_image = crud.get_image(db, image_id)
+    if db_image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # check if image belongs to user
+    if db_image.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if db_image.phash is None:
+        return []
+
+    candidates = [(other_id, phash) for other_id, phash in crud.get_user_phashes(
+        db, current_user.id) if other_id != image_id]
+    distances = hamming_distances(
+        [phash for _, phash in candidates], db_image.phash)
+    matches = sorted((int(distance), other_id) for (other_id, _), distance in zip(
+        candidates, distances) if distance <= max_distance)
+    images = {image.id: image for image in crud.get_images_by_ids(
+        db, [other_id for _, other_id in matches])}
+    return [schemas.DuplicateImage(**schemas.Image.from_orm(images[other_id]).dict(), distance=distance)
+            for distance, other_id in matches]
+
+
+def get_stored_image(db: Session, image_id: int) -> models.Image:
+    db_image = crud.get_image(db, image_id)
+    if db_image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if db_image.sha256 is None:
+        # uploaded before files were stored
+        raise HTTPException(status_code=404, detail="Image file not found")
+    return db_image
+
+
+@app.get("/images/{image_id}/thumbnail")
+def read_image_thumbnail(image_id: int, request: Request, size: int = THUMBNAIL_SIZES[0], db: Session = Depends(get_db)):
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(
+            status_code=400, detail=f"Thumbnail size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}")
+    db_image = get_stored_image(db, image_id)
+    store = get_store()
+    try:
+        path = store.thumbnail_path(db_image.sha256, size) or create_thumbnail(store, db_image.sha256, size)
+    except InvalidImageError:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image file not found")
+    return file_response(request, path, THUMBNAIL_MEDIA_TYPES[THUMBNAIL_FORMAT], etag=f'"{db_image.sha256}-{size}"')
+
+
+@app.get("/images/{image_id}/file")
+def read_image_file(image_id: int, request: Request, db: Session = Depends(get_db)):
+    db_image = get_stored_image(db, image_id)
+    path = get_store().original_path(db_image.sha256)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image file not found")
+    media_type = mimetypes.guess_type(db_image.path)[0] or "application/octet-stream"
+    return file_response(request, path, media_type, etag=f'"{db_image.sha256}"')
 
 
 @app.get("/images/{object}", response_model=List[schemas.Image])
 def read_images_by_object(
-    object: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+    object: str, request: Request, match: Literal["all", "any"] = "all", min_score: float = 0.0, cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), db: Session = Depends(get_db)
 ):
-    images = crud.get_images_by_object(
-        db, object=object, skip=skip, limit=limit)
-    return images
+    def build():
+        images = crud.get_images_by_object(
+            db, object=object, match_all=match != "any", min_score=min_score, cursor=cursor, limit=limit, skip=skip)
+        return [schemas.Image.from_orm(image) for image in images.items], images.next_cursor
+    return response_cache.cached_response(request, [response_cache.IMAGES], build)
 
 
 @app.get("/users/me/images/{object}", response_model=List[schemas.Image])
 def read_own_images_by_object(
-    user_id: int, object: str, current_user: User = Depends(get_current_active_user), skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+    user_id: int, object: str, response: Response, current_user: Principal = Depends(get_current_active_user), match: Literal["all", "any"] = "all", min_score: float = 0.0, cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), db: Session = Depends(get_db)
 ):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     images = crud.get_own_images_by_object(
-        db, object=object, skip=skip, limit=limit, user_id=user_id)
-    return images
+        db, object=object, match_all=match != "any", min_score=min_score, cursor=cursor, limit=limit, skip=skip, user_id=user_id)
+    return page_items(response, images)
 
 
-@app.get("/images/albums/", response_model=list[schemas.Album])
-def read_albums(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    albums = crud.get_albums(db=db, skip=skip, limit=limit)
-    return albums
+@app.get("/images/albums/", response_model=list[schemas.AlbumList], response_model_exclude_unset=True)
+def read_albums(request: Request, cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), expand: list[Literal["images"]] = Query([]), db: Session = Depends(get_db)):
+    def build():
+        albums = crud.get_albums(db=db, cursor=cursor, limit=limit, skip=skip, expand=expand)
+        return [expand_fields(schemas.AlbumList, album, expand).dict(exclude_unset=True) for album in albums.items], albums.next_cursor
+    # expanded albums embed images and their objects
+    return response_cache.cached_response(request, [response_cache.ALBUMS, response_cache.IMAGES], build)
 
 
-@app.get("/users/me/images/albums/", response_model=list[schemas.Album])
-def read_own_albums(user_id: int, current_user: User = Depends(get_current_active_user), skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/users/me/images/albums/", response_model=list[schemas.AlbumList], response_model_exclude_unset=True)
+def read_own_albums(user_id: int, response: Response, current_user: Principal = Depends(get_current_active_user), cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), expand: list[Literal["images"]] = Query([]), db: Session = Depends(get_db)):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     albums = crud.get_own_albums(
-        db=db, skip=skip, limit=limit, user_id=user_id)
-    return albums
+        db=db, cursor=cursor, limit=limit, skip=skip, user_id=user_id, expand=expand)
+    return [expand_fields(schemas.AlbumList, album, expand) for album in page_items(response, albums)]
 
 
 @app.post("/users/{user_id}/images/albums/", response_model=schemas.Album)
 def create_album_for_user(
     user_id: int,
     album: schemas.AlbumCreate,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     db_album = crud.get_album_by_name(db, name=album.name)
@@ -258,11 +736,11 @@ def add_image_to_album(
     user_id: int,
     album_id: int,
     image_id: int,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     db_album = crud.get_album(db, album_id)
@@ -282,25 +760,25 @@ def add_image_to_album(
 
 
 @app.get("/users/me/images/favorites/", response_model=List[schemas.Favorite])
-def read_own_favorite_images(user_id: int, current_user: User = Depends(get_current_active_user), skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_own_favorite_images(user_id: int, response: Response, current_user: Principal = Depends(get_current_active_user), cursor: str | None = None, limit: int = 100, skip: int = Query(0, deprecated=True), db: Session = Depends(get_db)):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     images = crud.get_own_favorite_images(
-        db=db, skip=skip, limit=limit, user_id=user_id)
-    return images
+        db=db, cursor=cursor, limit=limit, skip=skip, user_id=user_id)
+    return page_items(response, images)
 
 
 @app.post("/users/{user_id}/images/{image_id}/favorites", response_model=schemas.Favorite)
 def add_image_to_favorites(
     user_id: int,
     image_id: int,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     # check if current_user is the same as user_id
-    if crud.get_user(db, user_id) != current_user:
+    if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     db_image = crud.get_image(db, image_id)
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# minimal Prometheus-style metrics kept in process memory
+_registry: list["Metric"] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: dict[str, str] | None = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+        return header + "".join(sample + "\n" for sample in self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, *args, buckets: tuple[float, ...] = default_buckets, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[key] += value
+
+    def samples(self):
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+        samples = []
+        for key, bucket_counts in counts.items():
+            for bound, count in zip((*self.buckets, "+Inf"), bucket_counts):
+                samples.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, {'le': str(bound)})} {count}")
+            labels = _format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {sums[key]}")
+            samples.append(f"{self.name}_count{labels} {bucket_counts[-1]}")
+        return samples
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values.items()]
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+request_seconds = Histogram(
+    "http_request_seconds", "Request latency by route", labels=("method", "route", "status"))
+stage_seconds = Histogram(
+    "upload_stage_seconds", "Time spent in each stage of an upload", labels=("stage",))
+db_query_seconds = Histogram(
+    "db_query_seconds", "Duration of single database statements")
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "Database statements executed per request", labels=("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+
+# statements run while handling the current request; a mutable list so
+# worker threads of the request (which get a copy of the context) can count
+_request_queries: ContextVar[list[int] | None] = ContextVar("request_queries", default=None)
+
+
+def start_request_queries() -> list[int]:
+    queries = [0]
+    _request_queries.set(queries)
+    return queries
+
+
+def count_query(duration: float):
+    db_query_seconds.observe(duration)
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in _registry)
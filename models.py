@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, UniqueConstraint, Table
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, LargeBinary, String, UniqueConstraint, Table
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -33,14 +33,21 @@ class Image(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     path = Column(String, index=True)
+    sha256 = Column(String, index=True)
+    phash = Column(String, nullable=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # created by POST /users/me/import: objects and embedding come from the
+    # client, so they are never reused as another upload's classification
+    imported = Column(Boolean, nullable=True, default=False)
 
     owner = relationship("User", back_populates="images")
     objects = relationship("ImageObject", back_populates="images")
+    embedding = relationship(
+        "ImageEmbedding", back_populates="image", uselist=False)
     __table_args__ = (UniqueConstraint(
-        'path', 'owner_id', name='_path_owner_uc'),)
+        'sha256', 'owner_id', name='_sha256_owner_uc'),)
 
-    __str__ = __repr__ = lambda self: f"Image(id={self.id}, path={self.path}, owner_id={self.owner_id})"
+    __str__ = __repr__ = lambda self: f"Image(id={self.id}, path={self.path}, sha256={self.sha256}, owner_id={self.owner_id})"
 
 
 class ImageObject(Base):
@@ -48,11 +55,92 @@ class ImageObject(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     object = Column(String, index=True)
+    score = Column(Float, index=True)
     image_id = Column(Integer, ForeignKey("images.id"))
+    # model that produced the object, "manual" for objects added through the API
+    model_version = Column(String, nullable=True)
 
     images = relationship("Image", back_populates="objects")
+    __table_args__ = (Index('ix_image_objects_object_score', 'object', 'score'),
+                      Index('ix_image_objects_image_version_object', 'image_id', 'model_version', 'object', unique=True))
 
-    __str__ = __repr__ = lambda self: f"ImageObject(id={self.id}, name={self.name})"
+    __str__ = __repr__ = lambda self: f"ImageObject(id={self.id}, object={self.object}, score={self.score}, model_version={self.model_version})"
+
+
+class ImageTag(Base):
+    # inverted index of ImageObject labels: one row per word of every tag
+    __tablename__ = "image_tags"
+
+    id = Column(Integer, primary_key=True, index=True)
+    token = Column(String)
+    score = Column(Float)
+    image_id = Column(Integer, ForeignKey("images.id"), index=True)
+    model_version = Column(String, nullable=True)
+    __table_args__ = (Index('ix_image_tags_token_image', 'token', 'image_id'),)
+
+    __str__ = __repr__ = lambda self: f"ImageTag(id={self.id}, token={self.token}, image_id={self.image_id})"
+
+
+class UserTagCount(Base):
+    # number of the owner's images tagged with each object, kept up to date
+    # by the crud writes so facets never need a GROUP BY over image_objects
+    __tablename__ = "user_tag_counts"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    object = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index('ix_user_tag_counts_owner_count', 'owner_id', 'count'),)
+
+    __str__ = __repr__ = lambda self: f"UserTagCount(owner_id={self.owner_id}, object={self.object}, count={self.count})"
+
+
+class ImageEmbedding(Base):
+    __tablename__ = "image_embeddings"
+
+    image_id = Column(Integer, ForeignKey("images.id"), primary_key=True)
+    vector = Column(LargeBinary)
+
+    image = relationship("Image", back_populates="embedding")
+
+    __str__ = __repr__ = lambda self: f"ImageEmbedding(image_id={self.image_id})"
+
+
+class ClassificationJob(Base):
+    __tablename__ = "classification_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("images.id"), index=True)
+    status = Column(String, default="queued", index=True)
+    error = Column(String, nullable=True)
+
+    __str__ = __repr__ = lambda self: f"ClassificationJob(id={self.id}, image_id={self.image_id}, status={self.status})"
+
+
+class Change(Base):
+    # per-user log of created or modified entities for delta sync; the
+    # autoincrement id is the sync token
+    __tablename__ = "changes"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    __table_args__ = (Index('ix_changes_owner_id', 'owner_id', 'id'),)
+
+    __str__ = __repr__ = lambda self: f"Change(id={self.id}, owner_id={self.owner_id}, entity={self.entity}, entity_id={self.entity_id}, action={self.action})"
+
+
+class ReclassificationCheckpoint(Base):
+    # last image id whose objects were written for a model version, so an
+    # interrupted `jobs.py reclassify` continues where it stopped
+    __tablename__ = "reclassification_checkpoints"
+
+    model_version = Column(String, primary_key=True)
+    last_image_id = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+
+    __str__ = __repr__ = lambda self: f"ReclassificationCheckpoint(model_version={self.model_version}, last_image_id={self.last_image_id})"
 
 
 class Album(Base):
@@ -0,0 +1,63 @@
+import base64
+import json
+from typing import Any, NamedTuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+from config import MAX_PAGE_SIZE
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: str | None = None
+
+
+def encode_cursor(values: list[Any]) -> str:
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise InvalidCursorError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursorError("Invalid cursor")
+    return values
+
+
+def after(keys: list[tuple[Any, bool]], values: list[Any]):
+    # rows strictly after the cursor in (key1, key2, ...) order, e.g. for
+    # (score desc, id asc): score < s OR (score = s AND id > i)
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [key == value for (key, _), value in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, column < values[i] if descending else column > values[i]))
+    return or_(*clauses)
+
+
+def paginate(query: Query, keys: list[tuple[Any, bool]], cursor: str | None = None, limit: int = 100, skip: int = 0) -> Page:
+    # keyset pagination: the last row's sort keys become the next cursor, so
+    # every page is an index range scan no matter how deep it is
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = [column for column, _ in keys]
+    query = query.add_columns(*columns).order_by(
+        *(column.desc() if descending else column.asc() for column, descending in keys))
+    if cursor:
+        query = query.filter(after(keys, decode_cursor(cursor, len(keys))))
+    elif skip:
+        # kept for old clients, deep offsets are slow
+        query = query.offset(skip)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][-len(keys):]))
+    return Page([row[0] for row in rows], next_cursor)
@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from config import MAX_IMAGE_PIXELS, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY
+
+IMAGE_SIZE = (224, 224)
+
+# PIL only warns below twice its own limit, we refuse anything above ours
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+def open_image(file) -> Image.Image:
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        file = io.BytesIO(file)
+    try:
+        image = Image.open(file)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(str(e)) from e
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImageError(
+            f"Image has {width * height} pixels, the limit is {MAX_IMAGE_PIXELS}")
+    return image
+
+
+def decode_image(file, min_size: tuple[int, int]) -> Image.Image:
+    image = open_image(file)
+    # JPEG can be decoded at 1/2, 1/4 or 1/8 scale directly from the DCT
+    # coefficients, which is much cheaper than decoding 12 MP and resizing
+    image.draft('RGB', min_size)
+    try:
+        image = ImageOps.exif_transpose(image)
+        return image.convert('RGB')
+    except (OSError, SyntaxError) as e:
+        raise InvalidImageError(str(e)) from e
+
+
+def resize(image: Image.Image, size: tuple[int, int] = IMAGE_SIZE) -> Image.Image:
+    return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def load_image(file, size: tuple[int, int] = IMAGE_SIZE) -> Image.Image:
+    return resize(decode_image(file, (size[0] * 2, size[1] * 2)), size)
+
+
+def encode_thumbnail(image: Image.Image, size: int, format: str = THUMBNAIL_FORMAT, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    # keeps the aspect ratio, the longest side becomes at most `size`
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.BICUBIC, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format, quality=quality)
+    return buffer.getvalue()
+
+
+def to_tensor(image: Image.Image, out: np.ndarray | None = None) -> np.ndarray:
+    # MobileNetV2 expects float32 in [-1, 1] (keras preprocess_input)
+    pixels = np.asarray(image, dtype=np.uint8)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.multiply(pixels, np.float32(1 / 127.5), out=out, dtype=np.float32)
+    out -= 1.0
+    return out
+
+
+def read_imagefile(file, out: np.ndarray | None = None) -> np.ndarray:
+    return to_tensor(load_image(file), out=out)
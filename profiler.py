@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+from config import PROFILER_INTERVAL_MS
+
+
+class SamplingProfiler:
+    # a background thread that periodically records the stack of every other
+    # thread; cheap enough to leave on in production at ~10 ms intervals
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._stacks: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                # walk the frames directly: traceback.extract_stack also reads
+                # each source line through linecache, too slow every 10 ms
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                samples.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(samples)
+
+    def collapsed(self, reset: bool = False) -> str:
+        # "frame;frame;frame count" lines, the input format of flamegraph.pl
+        # and speedscope
+        with self._lock:
+            stacks = self._stacks.most_common()
+            if reset:
+                self._stacks.clear()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
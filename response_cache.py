@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Iterable, NamedTuple
+
+from cachetools import TTLCache
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+from responses import etag_matches
+
+# namespaces of cached data; crud writes bump their version, which changes
+# the keys of every response built from them
+IMAGES = "images"
+ALBUMS = "albums"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    next_cursor: str | None
+
+
+class CacheBackend:
+    # storage for cached responses and namespace versions; a shared store
+    # (e.g. Redis) makes invalidation visible to every worker
+
+    def get(self, key: str) -> CachedResponse | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: CachedResponse):
+        raise NotImplementedError
+
+    def version(self, namespace: str) -> int:
+        raise NotImplementedError
+
+    def bump(self, namespace: str):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    # per process, so other workers see a write after at most the TTL
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._lock = threading.Lock()
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions: dict[str, int] = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+
+BACKENDS = {"memory": MemoryBackend}
+
+if RESPONSE_CACHE_BACKEND not in BACKENDS:
+    raise ValueError(
+        f"Unknown response cache backend {RESPONSE_CACHE_BACKEND!r}, expected one of {', '.join(BACKENDS)}")
+backend: CacheBackend = BACKENDS[RESPONSE_CACHE_BACKEND]()
+
+
+def bump(*namespaces: str):
+    for namespace in namespaces:
+        backend.bump(namespace)
+
+
+def make_key(request: Request, namespaces: Iterable[str]) -> str:
+    versions = ",".join(f"{namespace}={backend.version(namespace)}" for namespace in namespaces)
+    params = "&".join(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{params}#{versions}"
+
+
+def serialize(data: Any, next_cursor: str | None) -> CachedResponse:
+    body = json.dumps(jsonable_encoder(data), separators=(",", ":")).encode()
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return CachedResponse(body, etag, next_cursor)
+
+
+def cached_response(request: Request, namespaces: Iterable[str], build: Callable[[], tuple[Any, str | None]]) -> Response:
+    # build() returns the JSON-able body and the next page cursor; it only
+    # runs on a miss, a hit skips the queries and the serialization
+    if RESPONSE_CACHE_TTL > 0:
+        key = make_key(request, namespaces)
+        entry = backend.get(key)
+        if entry is None:
+            entry = serialize(*build())
+            backend.set(key, entry)
+    else:
+        entry = serialize(*build())
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if entry.next_cursor:
+        headers["X-Next-Cursor"] = entry.next_cursor
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
@@ -0,0 +1,63 @@
+import os
+import re
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+# stored files never change for a given content hash
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_range_pattern = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def parse_range(header: str, file_size: int) -> tuple[int, int] | None:
+    # a single "bytes=start-end" range, end inclusive; multipart ranges are
+    # answered with the whole file
+    match = _range_pattern.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # suffix range: the last `end` bytes
+        return max(file_size - int(end), 0), file_size - 1
+    end = min(int(end), file_size - 1) if end else file_size - 1
+    return int(start), end
+
+
+def iter_file(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: str, media_type: str, etag: str, cache_control: str = IMMUTABLE) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    file_size = os.path.getsize(path)
+    range_header = request.headers.get("range")
+    # a range is only honoured for the representation the client already has
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_range(range_header, file_size)
+        if byte_range is not None:
+            start, end = byte_range
+            if start > end or start >= file_size:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}"})
+            length = end - start + 1
+            headers.update({"Content-Range": f"bytes {start}-{end}/{file_size}", "Content-Length": str(length)})
+            return StreamingResponse(iter_file(path, start, length), status_code=206, media_type=media_type, headers=headers)
+    # FileResponse streams the file in chunks instead of reading it into memory
+    return FileResponse(path, media_type=media_type, headers=headers)
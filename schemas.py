@@ -1,4 +1,9 @@
-from pydantic import BaseModel
+import base64
+from typing import ClassVar, Literal
+
+from pydantic import BaseModel, constr, validator
+
+from similarity import EMBEDDING_BYTES
 
 
 class Token(BaseModel):
@@ -8,11 +13,25 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None = None
+    user_id: int | None = None
+
+
+class Principal(BaseModel):
+    # the authenticated user, detached from any database session
+    id: int
+    username: str
+    email: str
+    is_active: bool
+
+    class Config:
+        orm_mode = True
+        allow_mutation = False
 
 
 class ImageObject(BaseModel):
     image_id: int
     object: str
+    score: float | None = None
 
     class Config:
         orm_mode = True
@@ -23,12 +42,14 @@ class ImageBase(BaseModel):
 
 
 class ImageCreate(ImageBase):
-    pass
+    sha256: str | None = None
+    phash: str | None = None
 
 
 class Image(ImageBase):
     id: int
     owner_id: int
+    sha256: str | None = None
 
     objects: list[ImageObject] = []
 
@@ -36,6 +57,39 @@ class Image(ImageBase):
         orm_mode = True
 
 
+class TagCount(BaseModel):
+    object: str
+    count: int
+
+    class Config:
+        orm_mode = True
+
+
+class SimilarImage(Image):
+    score: float
+
+
+class DuplicateImage(Image):
+    distance: int
+
+
+class ImageUploadResult(BaseModel):
+    path: str
+    status: str
+    detail: str | None = None
+    image: Image | None = None
+
+
+class Job(BaseModel):
+    id: int
+    image_id: int
+    status: str
+    error: str | None = None
+
+    class Config:
+        orm_mode = True
+
+
 class AlbumBase(BaseModel):
     name: str
 
@@ -54,6 +108,23 @@ class Album(AlbumBase):
         orm_mode = True
 
 
+class AlbumInfo(AlbumBase):
+    id: int
+    owner_id: int
+
+    class Config:
+        orm_mode = True
+
+
+class AlbumList(AlbumInfo):
+    images: list[Image] | None = None
+
+    expandable: ClassVar[set[str]] = {"images"}
+
+    class Config:
+        orm_mode = True
+
+
 class UserBase(BaseModel):
     username: str
     email: str
@@ -86,3 +157,89 @@ class Favorite(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class AlbumSync(AlbumInfo):
+    image_ids: list[int] = []
+
+
+class Change(BaseModel):
+    # one entity per change; data is missing for deletions
+    entity: str
+    id: int
+    action: str
+    image: Image | None = None
+    album: AlbumSync | None = None
+    favorite: Favorite | None = None
+
+
+class ChangeSet(BaseModel):
+    changes: list[Change]
+    # pass as ?since= on the next call
+    token: str
+    has_more: bool
+
+
+class ExportObject(BaseModel):
+    object: str
+    score: float | None = None
+    model_version: str | None = None
+
+
+# lines of GET /users/me/export and POST /users/me/import; ids are the ones of
+# the exporting library, albums and favorites refer to the exported image ids
+class ExportImage(BaseModel):
+    type: Literal["image"]
+    id: int
+    path: str
+    # the sha256 addresses stored files and the phash is parsed as a number,
+    # neither is taken from the client unchecked
+    sha256: constr(regex=r"^[0-9a-f]{64}$") | None = None
+    phash: constr(regex=r"^[0-9a-f]{16}$") | None = None
+    objects: list[ExportObject] = []
+    # base64 of the stored float16 vector in the export
+    embedding: bytes | None = None
+
+    @validator("embedding", pre=True)
+    def decode_embedding(cls, value):
+        if isinstance(value, str):
+            value = base64.b64decode(value, validate=True)
+        if value is not None and len(value) != EMBEDDING_BYTES:
+            raise ValueError(f"embedding must be {EMBEDDING_BYTES} bytes")
+        return value
+
+
+class ExportAlbum(BaseModel):
+    type: Literal["album"]
+    id: int
+    name: str
+    image_ids: list[int] = []
+
+
+class ExportFavorite(BaseModel):
+    type: Literal["favorite"]
+    image_id: int
+
+
+class ImportResult(BaseModel):
+    images: int = 0
+    # already in the library, matched by sha256
+    existing_images: int = 0
+    albums: int = 0
+    favorites: int = 0
+    # album images and favorites whose image was not in the import
+    skipped: int = 0
+
+
+class UserList(UserBase):
+    id: int
+    is_active: bool
+
+    images: list[Image] | None = None
+    albums: list[AlbumInfo] | None = None
+    favorites: list[Favorite] | None = None
+
+    expandable: ClassVar[set[str]] = {"images", "albums", "favorites"}
+
+    class Config:
+        orm_mode = True
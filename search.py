@@ -0,0 +1,19 @@
+import re
+
+# tags are indexed per lowercase word, so "golden retriever" is found by
+# "golden", "retr" or "retriever golden"
+_token_re = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _token_re.findall(text.lower()):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    # tokens starting with prefix sort in [prefix, prefix + max char), which
+    # lets the query use the token index instead of a LIKE scan
+    return prefix + "\U0010ffff"
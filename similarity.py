@@ -0,0 +1,94 @@
+import threading
+
+import numpy as np
+
+from config import EMBEDDING_SIZE
+
+EMBEDDING_DTYPE = np.float16
+# size of a stored vector, see to_blob
+EMBEDDING_BYTES = EMBEDDING_SIZE * np.dtype(EMBEDDING_DTYPE).itemsize
+
+
+def to_blob(embedding: np.ndarray) -> bytes:
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE).astype(np.float32)
+
+
+class SimilarityIndex:
+    # in-memory matrix of L2-normalized embeddings, one row per image,
+    # so cosine similarity is a single matrix-vector product. Rows are kept
+    # as float16 like the stored blobs, half the memory of float32; only
+    # the rows a query compares against are upcast
+
+    def __init__(self, capacity: int = 1024, dim: int = EMBEDDING_SIZE):
+        self.dim = dim
+        # last change log id whose embeddings are in the index
+        self.change_id = 0
+        self._lock = threading.Lock()
+        self._size = 0
+        self._vectors: np.ndarray | None = None
+        self._image_ids = np.empty(capacity, dtype=np.int64)
+        self._owner_ids = np.empty(capacity, dtype=np.int64)
+        self._rows: dict[int, int] = {}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, needed: int):
+        if self._vectors is None:
+            self._vectors = np.empty(
+                (len(self._image_ids), self.dim), dtype=EMBEDDING_DTYPE)
+        capacity = len(self._image_ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._vectors = np.resize(self._vectors, (capacity, self.dim))
+        self._image_ids = np.resize(self._image_ids, capacity)
+        self._owner_ids = np.resize(self._owner_ids, capacity)
+
+    def add(self, image_id: int, owner_id: int, embedding: np.ndarray):
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            # e.g. stored by another model, it cannot be compared with the rest
+            return
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        with self._lock:
+            row = self._rows.get(image_id)
+            if row is None:
+                self._grow(self._size + 1)
+                row = self._size
+                self._size += 1
+                self._rows[image_id] = row
+            self._vectors[row] = vector
+            self._image_ids[row] = image_id
+            self._owner_ids[row] = owner_id
+
+    def get(self, image_id: int) -> np.ndarray | None:
+        with self._lock:
+            row = self._rows.get(image_id)
+            if row is None:
+                return None
+            return self._vectors[row].astype(np.float32)
+
+    def search(self, image_id: int, owner_id: int, k: int = 10) -> list[tuple[int, float]]:
+        with self._lock:
+            row = self._rows.get(image_id)
+            if row is None:
+                return []
+            query = self._vectors[row].astype(np.float32)
+            rows = np.flatnonzero(self._owner_ids[:self._size] == owner_id)
+            rows = rows[rows != row]
+            if len(rows) == 0 or k < 1:
+                return []
+            scores = self._vectors[rows].astype(np.float32) @ query
+            image_ids = self._image_ids[rows]
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(image_ids[i]), float(scores[i])) for i in top]
@@ -0,0 +1,117 @@
+import os
+import re
+import shutil
+import tempfile
+from typing import BinaryIO
+
+from config import IMAGE_STORE, IMAGE_STORE_DIR, THUMBNAIL_FORMAT
+from metrics import stage_seconds, timer
+from preprocessing import decode_image, encode_thumbnail
+
+THUMBNAIL_MEDIA_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+_key_pattern = re.compile(r"[0-9a-f]{64}")
+
+
+class ImageStore:
+    # keeps uploaded originals and their thumbnails, addressed by the sha256
+    # of the original bytes, so identical uploads share one copy
+
+    def save_original(self, sha256: str, data: bytes | BinaryIO):
+        raise NotImplementedError
+
+    def save_thumbnail(self, sha256: str, size: int, data: bytes):
+        raise NotImplementedError
+
+    def original_path(self, sha256: str) -> str | None:
+        raise NotImplementedError
+
+    def thumbnail_path(self, sha256: str, size: int) -> str | None:
+        raise NotImplementedError
+
+
+def is_valid_key(sha256: str | None) -> bool:
+    return sha256 is not None and _key_pattern.fullmatch(sha256) is not None
+
+
+def _shard(sha256: str) -> str:
+    # keys end up in file paths, anything but a hex digest is refused
+    if not is_valid_key(sha256):
+        raise ValueError(f"Invalid image key {sha256!r}")
+    # two levels of fan-out keep directories small
+    return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+
+class LocalImageStore(ImageStore):
+
+    def __init__(self, root: str = IMAGE_STORE_DIR, thumbnail_format: str = THUMBNAIL_FORMAT):
+        self.root = root
+        self.thumbnail_extension = "." + thumbnail_format.lower()
+
+    def _original(self, sha256: str) -> str:
+        return os.path.join(self.root, "originals", _shard(sha256))
+
+    def _thumbnail(self, sha256: str, size: int) -> str:
+        return os.path.join(self.root, "thumbnails", str(size), _shard(sha256) + self.thumbnail_extension)
+
+    def _write(self, path: str, data: bytes | BinaryIO):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file and rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    f.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, f)
+                    data.seek(0)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def save_original(self, sha256, data):
+        with timer(stage_seconds, stage="store"):
+            self._write(self._original(sha256), data)
+
+    def save_thumbnail(self, sha256, size, data):
+        self._write(self._thumbnail(sha256, size), data)
+
+    def original_path(self, sha256):
+        if not is_valid_key(sha256):
+            return None
+        path = self._original(sha256)
+        return path if os.path.exists(path) else None
+
+    def thumbnail_path(self, sha256, size):
+        if not is_valid_key(sha256):
+            return None
+        path = self._thumbnail(sha256, size)
+        return path if os.path.exists(path) else None
+
+
+STORES = {"local": LocalImageStore}
+
+_store: ImageStore | None = None
+
+
+def get_store() -> ImageStore:
+    global _store
+    if _store is None:
+        if IMAGE_STORE not in STORES:
+            raise ValueError(
+                f"Unknown image store {IMAGE_STORE!r}, expected one of {', '.join(STORES)}")
+        _store = STORES[IMAGE_STORE]()
+    return _store
+
+
+def create_thumbnail(store: ImageStore, sha256: str, size: int) -> str | None:
+    # for originals stored before `size` was configured
+    path = store.original_path(sha256)
+    if path is None:
+        return None
+    store.save_thumbnail(sha256, size, encode_thumbnail(decode_image(path, (size, size)), size))
+    return store.thumbnail_path(sha256, size)
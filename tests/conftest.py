@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+# the app reads its configuration at import, so the environment is set up
+# before any test module imports it: a throwaway SQLite database and store,
+# a labels file so the keras mapping is never needed, no model at startup
+# and no response cache (it would answer repeated requests without queries)
+workdir = tempfile.mkdtemp(prefix="searching-images-tests-")
+labels_path = os.path.join(workdir, "labels.txt")
+with open(labels_path, "w") as f:
+    f.writelines(f"{i} label{i}\n" for i in range(1000))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'test.db')}",
+    "LABELS_PATH": labels_path,
+    "IMAGE_STORE_DIR": os.path.join(workdir, "images"),
+    "UPLOAD_SPOOL_DIR": os.path.join(workdir, "spool"),
+    "MODEL_PRELOAD": "0",
+    "RESPONSE_CACHE_TTL": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
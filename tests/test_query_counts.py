@@ -0,0 +1,96 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+
+import main
+import models
+from database import SessionLocal, async_engine, engine
+
+SMALL_PAGE, LARGE_PAGE = 2, 20
+# selectinload fetches related rows in batches of 500 parent ids, a page of
+# users with all their images stays below that
+USERS = 25
+IMAGES_PER_USER = 20
+OBJECTS_PER_IMAGE = 3
+ALBUMS_PER_USER = 20
+IMAGES_PER_ALBUM = 5
+FAVORITES_PER_USER = 5
+
+# statements per request, whatever the page size
+MAX_QUERIES = {
+    "/images/": 2,
+    "/users/?expand=images&expand=albums&expand=favorites": 5,
+    "/images/albums/?expand=images": 3,
+    "/users/me/images/": 2,
+}
+
+
+def seed():
+    db = SessionLocal()
+    try:
+        db.execute(insert(models.User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": "", "is_active": True}
+            for i in range(USERS)])
+        user_ids = [user_id for user_id, in db.query(models.User.id).order_by(models.User.id)]
+        db.execute(insert(models.Image), [
+            {"path": f"{owner_id}_{i}.jpg", "sha256": f"{owner_id}_{i}", "owner_id": owner_id}
+            for owner_id in user_ids for i in range(IMAGES_PER_USER)])
+        images = db.query(models.Image.id, models.Image.owner_id).order_by(models.Image.id).all()
+        db.execute(insert(models.ImageObject), [
+            {"object": f"label{i}", "score": 0.5, "image_id": image_id, "model_version": "test"}
+            for image_id, _ in images for i in range(OBJECTS_PER_IMAGE)])
+        images_by_owner = {}
+        for image_id, owner_id in images:
+            images_by_owner.setdefault(owner_id, []).append(image_id)
+        db.execute(insert(models.Album), [
+            {"name": f"album{i}", "owner_id": owner_id} for owner_id in user_ids for i in range(ALBUMS_PER_USER)])
+        db.execute(insert(models.album_image_association_table), [
+            {"album_id": album_id, "image_id": image_id}
+            for album_id, owner_id in db.query(models.Album.id, models.Album.owner_id)
+            for image_id in images_by_owner[owner_id][:IMAGES_PER_ALBUM]])
+        db.execute(insert(models.Favorite), [
+            {"owner_id": owner_id, "image_id": image_id}
+            for owner_id in user_ids for image_id in images_by_owner[owner_id][:FAVORITES_PER_USER]])
+        db.commit()
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def client():
+    seed()
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def queries():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", count)
+    yield statements
+    for target in (engine, async_engine.sync_engine):
+        event.remove(target, "before_cursor_execute", count)
+
+
+def count_queries(client, queries, url: str, limit: int) -> int:
+    headers = {"Authorization": "Bearer " + main.create_access_token({"sub": "user0", "uid": 1})}
+    # the first request fills the auth cache, which is not what is measured
+    assert client.get(url, params={"limit": limit}, headers=headers).status_code == 200
+    queries.clear()
+    response = client.get(url, params={"limit": limit}, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == limit
+    return len(queries)
+
+
+@pytest.mark.parametrize("url", MAX_QUERIES)
+def test_queries_do_not_grow_with_page_size(client, queries, url):
+    small = count_queries(client, queries, url, limit=SMALL_PAGE)
+    large = count_queries(client, queries, url, limit=LARGE_PAGE)
+    assert small == large
+    assert large <= MAX_QUERIES[url]
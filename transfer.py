@@ -0,0 +1,159 @@
+import base64
+import json
+from typing import AsyncIterator, Callable, Iterator
+
+import crud
+import schemas
+from config import EXPORT_CHUNK_SIZE, IMPORT_CHUNK_SIZE, MAX_IMPORT_RECORD_SIZE, MAX_IMPORT_SIZE
+from database import SessionLocal
+from uploads import UploadTooLargeError
+
+RECORD_TYPES = {"image": schemas.ExportImage, "album": schemas.ExportAlbum, "favorite": schemas.ExportFavorite}
+
+
+class InvalidImportError(ValueError):
+    pass
+
+
+def ndjson(records: list[dict]) -> bytes:
+    return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+def export_library(user_id: int, embeddings: bool = True, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    # all images, then albums, then favorites, so an import has seen every
+    # image before anything refers to it. Reads are keyset paged and the
+    # transaction ends before each chunk is sent: memory stays flat and no
+    # connection is held while a slow client downloads. Writes made during
+    # the export may or may not be included.
+    db = SessionLocal()
+    try:
+        after_id = 0
+        while rows := crud.get_export_images(db, user_id, after_id, chunk_size, embeddings):
+            objects = {}
+            for image_id, object, score, model_version in crud.get_export_objects(db, [row[0] for row in rows]):
+                objects.setdefault(image_id, []).append(
+                    {"object": object, "score": score, "model_version": model_version})
+            db.rollback()
+            yield ndjson([{
+                "type": "image", "id": image_id, "path": path, "sha256": sha256, "phash": phash,
+                "objects": objects.get(image_id, []),
+                "embedding": base64.b64encode(vector).decode() if vector is not None else None,
+            } for image_id, path, sha256, phash, vector in rows])
+            after_id = rows[-1][0]
+
+        after_id = 0
+        while rows := crud.get_export_albums(db, user_id, after_id, chunk_size):
+            image_ids = crud.get_album_image_ids(db, [album_id for album_id, _ in rows])
+            db.rollback()
+            # large albums are split into several records with the same name,
+            # the import merges them, so no line grows with the album
+            yield ndjson([{"type": "album", "id": album_id, "name": name, "image_ids": image_ids[album_id][i:i + chunk_size]}
+                          for album_id, name in rows for i in range(0, max(len(image_ids[album_id]), 1), chunk_size)])
+            after_id = rows[-1][0]
+
+        after_id = 0
+        while rows := crud.get_export_favorites(db, user_id, after_id, chunk_size):
+            db.rollback()
+            yield ndjson([{"type": "favorite", "image_id": image_id} for _, image_id in rows])
+            after_id = rows[-1][0]
+    finally:
+        db.close()
+
+
+def parse_record(number: int, line: bytes):
+    try:
+        data = json.loads(line)
+        record_type = RECORD_TYPES[data["type"]]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidImportError(f"Line {number}: expected a JSON object with a type of {', '.join(RECORD_TYPES)}")
+    try:
+        return record_type.parse_obj(data)
+    except ValueError as e:
+        raise InvalidImportError(f"Line {number}: {e}")
+
+
+async def iter_records(chunks: AsyncIterator[bytes], max_size: int = MAX_IMPORT_SIZE,
+                       max_record_size: int = MAX_IMPORT_RECORD_SIZE):
+    # parses the body line by line as it arrives instead of reading it whole;
+    # only the current line is buffered and it is bounded by max_record_size
+    size, number, line = 0, 0, bytearray()
+
+    def append(data: bytes):
+        line.extend(data)
+        if len(line) > max_record_size:
+            raise InvalidImportError(f"Line {number + 1}: longer than {max_record_size} bytes")
+
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            raise UploadTooLargeError(f"Import is larger than {max_size} bytes")
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            append(chunk[start:end])
+            number += 1
+            if line.strip():
+                yield parse_record(number, line)
+            line.clear()
+            start = end + 1
+        append(chunk[start:])
+    if line.strip():
+        yield parse_record(number + 1, line)
+
+
+class LibraryImport:
+    # buffers parsed records and writes them in one transaction per chunk,
+    # without running inference; only the exported -> new image id map grows
+    # with the size of the library
+
+    def __init__(
+        self,
+        user_id: int,
+        on_image: Callable[[int, int, bytes], None] | None = None,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+    ):
+        self.user_id = user_id
+        self.on_image = on_image
+        self.chunk_size = chunk_size
+        self.result = schemas.ImportResult()
+        self._image_ids: dict[int, int] = {}
+        self._images: list[schemas.ExportImage] = []
+        self._albums: list[schemas.ExportAlbum] = []
+        self._favorites: list[schemas.ExportFavorite] = []
+
+    def add(self, record) -> bool:
+        # True once a chunk is full and should be flushed
+        if isinstance(record, schemas.ExportImage):
+            self._images.append(record)
+        elif isinstance(record, schemas.ExportAlbum):
+            self._albums.append(record)
+        else:
+            self._favorites.append(record)
+        return len(self._images) + len(self._albums) + len(self._favorites) >= self.chunk_size
+
+    def _map_images(self, image_ids: list[int]) -> list[int]:
+        mapped = [self._image_ids[image_id] for image_id in image_ids if image_id in self._image_ids]
+        self.result.skipped += len(image_ids) - len(mapped)
+        return mapped
+
+    def flush(self):
+        # images first, albums and favorites of the same chunk may refer to them
+        db = SessionLocal()
+        try:
+            if self._images:
+                image_ids, created = crud.import_images(db, self.user_id, self._images)
+                self._image_ids.update(image_ids)
+                self.result.images += len(created)
+                self.result.existing_images += len(self._images) - len(created)
+                if self.on_image is not None:
+                    for image_id, embedding in created:
+                        if embedding is not None:
+                            self.on_image(image_id, self.user_id, embedding)
+            if self._albums:
+                albums = [(album.name, self._map_images(album.image_ids)) for album in self._albums]
+                self.result.albums += crud.import_albums(db, self.user_id, albums)
+            if self._favorites:
+                image_ids = self._map_images([favorite.image_id for favorite in self._favorites])
+                self.result.favorites += crud.import_favorites(db, self.user_id, image_ids)
+        finally:
+            db.close()
+        self._images, self._albums, self._favorites = [], [], []
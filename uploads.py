@@ -0,0 +1,35 @@
+import hashlib
+import shutil
+from typing import BinaryIO
+
+from config import MAX_UPLOAD_SIZE
+from metrics import stage_seconds, timer
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
+def hash_upload(file: BinaryIO, max_size: int = MAX_UPLOAD_SIZE) -> str:
+    # sha256 in one streaming pass, stopping as soon as the size limit is hit
+    sha256 = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    with timer(stage_seconds, stage="hash"):
+        while chunk := file.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLargeError(
+                    f"File is larger than {max_size} bytes")
+            sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def copy_upload(file: BinaryIO, path: str):
+    file.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(file, f, CHUNK_SIZE)
+    file.seek(0)
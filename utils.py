@@ -1,10 +1,70 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from passlib.context import CryptContext
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS
+from metrics import Counter, Histogram
+
+# hashes with any other cost fall outside min/max rounds and are flagged
+# for an upgrade by verify_and_update
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS)
+
+login_attempts = Counter(
+    "login_attempts_total", "Login attempts by result", labels=("result",))
+password_hash_seconds = Histogram(
+    "password_hash_seconds", "Time spent hashing or verifying a password, including queueing", labels=("operation",))
+
+_pool: ProcessPoolExecutor | None = None
 
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password, hashed_password):
+    # returns (valid, new_hash); new_hash is set when the stored hash uses
+    # outdated parameters and should be replaced
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    # bcrypt holds a core for ~100-300 ms, so a login storm is limited to
+    # PASSWORD_HASH_WORKERS cores instead of the whole request thread pool
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _run(operation: str, function, *args):
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_pool(), function, *args)
+    finally:
+        password_hash_seconds.observe(
+            time.perf_counter() - start, operation=operation)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run("verify", verify_and_update_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await _run("hash", get_password_hash, password)